@@ -0,0 +1,114 @@
+import json
+import multiprocessing
+import os
+import time
+
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.models import Max, Min
+
+from django_tricks.models.behaviors import ComputeFields
+
+
+def get_compute_fields(model):
+    """Return the ComputeFields declared on a concrete model."""
+    return [value for value in (getattr(model, name, None) for name in dir(model))
+            if isinstance(value, ComputeFields) and getattr(value, 'model', None) is model]
+
+
+def close_connections():
+    # Forked workers must not share the parent database connections
+    for connection in connections.all():
+        connection.close()
+
+
+def backfill_chunk(task):
+    label, name, start, end = task
+    computed = getattr(apps.get_model(label), name)
+    queryset = computed.model._default_manager.filter(pk__gte=start, pk__lt=end).order_by('pk')
+    return label, name, start, computed.backfill(queryset)
+
+
+class Command(BaseCommand):
+    help = ('Recompute the ComputeFields of every (or the given) model in pk range chunks '
+            'across a process pool, resuming from a checkpoint file.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('models', nargs='*', help='Model labels, as app_label.ModelName')
+        parser.add_argument('--chunk-size', type=int, default=5000, help='Primary keys per chunk.')
+        parser.add_argument('--processes', type=int, default=os.cpu_count(), help='Worker processes.')
+        parser.add_argument('--checkpoint', default='.backfill_computed_fields.json',
+                            help='File keeping the finished chunks, to resume after an interruption.')
+        parser.add_argument('--restart', action='store_true', help='Ignore the existing checkpoint.')
+
+    def get_models(self, labels):
+        try:
+            models = [apps.get_model(label) for label in labels] if labels else apps.get_models()
+        except (LookupError, ValueError) as err:
+            raise CommandError(str(err))
+
+        return [(model, computed) for model in models for computed in get_compute_fields(model)]
+
+    def load_checkpoint(self, path, restart):
+        if restart or not os.path.exists(path):
+            return {}
+
+        with open(path) as checkpoint:
+            return json.load(checkpoint)
+
+    def save_checkpoint(self, path, done):
+        with open('%s.tmp' % path, 'w') as checkpoint:
+            json.dump(done, checkpoint)
+        os.replace('%s.tmp' % path, path)
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        checkpoint = options['checkpoint']
+        done = self.load_checkpoint(checkpoint, options['restart'])
+        tasks = []
+
+        for model, computed in self.get_models(options['models']):
+            key = '%s.%s' % (model._meta.label, computed.name)
+            finished = set(done.setdefault(key, []))
+
+            # Expression backed fields are recomputed in the database at once
+            if not finished and computed.get_expressions():
+                updated = computed.recompute()
+                self.stdout.write('%s: %s rows recomputed with an UPDATE.' % (key, updated))
+
+            bounds = model._default_manager.aggregate(start=Min('pk'), end=Max('pk'))
+
+            if bounds['start'] is None:
+                continue
+
+            if not isinstance(bounds['start'], int):
+                raise CommandError('%s needs an integer primary key to be split in chunks.' % key)
+
+            # Chunks are aligned to the chunk size so a resumed run finds the same boundaries
+            first = bounds['start'] - bounds['start'] % chunk_size
+
+            for start in range(first, bounds['end'] + 1, chunk_size):
+                if start not in finished:
+                    tasks.append((model._meta.label, computed.name, start, start + chunk_size))
+
+        if not tasks:
+            self.stdout.write('Nothing to backfill.')
+            return
+
+        close_connections()
+        started = time.time()
+        rows = 0
+
+        with multiprocessing.Pool(options['processes'], initializer=close_connections) as pool:
+            results = pool.imap_unordered(backfill_chunk, tasks)
+
+            for index, (label, name, start, count) in enumerate(results, 1):
+                done['%s.%s' % (label, name)].append(start)
+                self.save_checkpoint(checkpoint, done)
+                rows += count
+                elapsed = time.time() - started
+                self.stdout.write('[%s/%s] %s.%s pk >= %s: %s rows, %.0f rows/s' % (
+                    index, len(tasks), label, name, start, count, rows / elapsed if elapsed else 0))
+
+        self.stdout.write('Backfilled %s rows in %.1fs.' % (rows, time.time() - started))
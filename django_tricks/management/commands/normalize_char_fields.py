@@ -0,0 +1,56 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import ExpressionWrapper, F, TextField
+
+from django_tricks.models.fields import NormalizedCharField
+
+
+class Command(BaseCommand):
+    help = 'Normalize the stored values of the NormalizedCharField columns of a model, in pk chunks.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('model', help='Model label, as app_label.ModelName')
+        parser.add_argument('fields', nargs='*', help='Field names, all the normalized fields by default.')
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help='Number of rows read and updated per transaction.')
+
+    def handle(self, *args, **options):
+        try:
+            model = apps.get_model(options['model'])
+        except (LookupError, ValueError) as err:
+            raise CommandError(str(err))
+
+        fields = [field for field in model._meta.concrete_fields if isinstance(field, NormalizedCharField)]
+
+        if options['fields']:
+            fields = [field for field in fields if field.name in options['fields']]
+
+        if not fields:
+            raise CommandError('%s has no NormalizedCharField to normalize.' % options['model'])
+
+        manager = model._default_manager
+        # Read the stored values, without the normalize_reads converter
+        raw = {'raw_%s' % field.attname: ExpressionWrapper(F(field.attname), output_field=TextField())
+               for field in fields}
+        rows = manager.order_by('pk').annotate(**raw).values_list('pk', *raw)
+        last_pk, updated = None, 0
+
+        while True:
+            pending = rows.filter(pk__gt=last_pk) if last_pk is not None else rows
+            chunk = list(pending[:options['chunk_size']])
+
+            if not chunk:
+                break
+
+            with transaction.atomic():
+                for pk, *values in chunk:
+                    changes = {field.attname: field.normalize(value) for field, value in zip(fields, values)
+                               if isinstance(value, str) and field.normalize(value) != value}
+                    if changes:
+                        manager.filter(pk=pk).update(**changes)
+                        updated += 1
+
+            last_pk = chunk[-1][0]
+
+        self.stdout.write('Normalized %s rows of %s.' % (updated, options['model']))
@@ -0,0 +1,25 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+
+from django_tricks.models.mixins import MPAwareModel
+
+
+class Command(BaseCommand):
+    help = 'Recompute the stored name and slug paths of a MPAwareModel tree.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('model', help='Model label, as app_label.ModelName')
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help='Number of nodes loaded and updated per transaction.')
+
+    def handle(self, *args, **options):
+        try:
+            model = apps.get_model(options['model'])
+        except (LookupError, ValueError) as err:
+            raise CommandError(str(err))
+
+        if not issubclass(model, MPAwareModel) or not model.get_stored_path_fields():
+            raise CommandError('%s does not define NAME_PATH_FIELD or SLUG_PATH_FIELD.' % options['model'])
+
+        updated = model.rebuild_stored_paths(chunk_size=options['chunk_size'])
+        self.stdout.write('Updated %s nodes of %s.' % (updated, options['model']))
@@ -0,0 +1,25 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+
+from django_tricks.models.mixins import MPAwareModel
+
+
+class Command(BaseCommand):
+    help = 'Recompute the stored rollup aggregates of a MPAwareModel tree.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('model', help='Model label, as app_label.ModelName')
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help='Number of nodes updated per transaction.')
+
+    def handle(self, *args, **options):
+        try:
+            model = apps.get_model(options['model'])
+        except (LookupError, ValueError) as err:
+            raise CommandError(str(err))
+
+        if not issubclass(model, MPAwareModel) or not model.get_rollups():
+            raise CommandError('%s does not declare any Rollup.' % options['model'])
+
+        updated = model.recompute_rollups(chunk_size=options['chunk_size'])
+        self.stdout.write('Updated %s nodes of %s.' % (updated, options['model']))
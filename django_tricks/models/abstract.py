@@ -1,16 +1,17 @@
 from uuid import uuid4
 
 from django.contrib.contenttypes.models import ContentType
-from django.db import models
+from django.db import models, transaction
 from django.utils.functional import cached_property
 from django.utils.translation import gettext_lazy as _
 
 from .mixins import MPAwareModel
+from .trees import Tree, TreeLoader
 
 treebeard = True
 
 try:
-    from treebeard.mp_tree import MP_Node
+    from treebeard.mp_tree import MP_Node, MP_NodeManager, MP_NodeQuerySet
 except ImportError:
     treebeard = False
 
@@ -31,14 +32,84 @@ class UniqueTokenModel(models.Model):
 
 
 if treebeard:
+    class MaterializedPathQuerySet(MP_NodeQuerySet):
+        def load_tree(self, parent=None):
+            """Load the tree, or the subtree under parent, in a single query and build it in memory."""
+            queryset = self
+
+            if parent is not None:
+                queryset = queryset.filter(path__startswith=parent.path, depth__gte=parent.depth)
+
+            return Tree(queryset.order_by('path'), steplen=self.model.steplen)
+
+        def delete(self, *args, **kwargs):
+            with transaction.atomic(using=self.db):
+                result = super().delete(*args, **kwargs)
+                self.model.invalidate_snapshot()
+
+            return result
+
+    class MaterializedPathManager(MP_NodeManager):
+        def get_queryset(self):
+            return MaterializedPathQuerySet(self.model).order_by('path')
+
+        def load_tree(self, parent=None):
+            return self.get_queryset().load_tree(parent)
+
     class MaterializedPathNode(MPAwareModel, MP_Node):
         slug = models.SlugField(max_length=255, db_index=True, unique=False, blank=True)
+
+        objects = MaterializedPathManager()
+
         node_order_by = ['name']
         node_order_by = ['numval', 'strval']
 
         class Meta:
             abstract = True
 
+        @classmethod
+        def bulk_load(cls, nodes, parent=None, batch_size=5000):
+            """Insert nested nodes, in treebeard's `load_bulk` format, with bulk_create batches."""
+            loader = TreeLoader(cls, parent=parent, batch_size=batch_size)
+            return cls.bulk_load_rows(loader.iter_nested(nodes), parent=parent, batch_size=batch_size)
+
+        @classmethod
+        def bulk_load_rows(cls, rows, parent=None, batch_size=5000):
+            """Insert a stream of (key, parent_key, data) rows listed level by level.
+
+            Return the number of inserted nodes.
+            """
+            with transaction.atomic():
+                inserted = TreeLoader(cls, parent=parent, batch_size=batch_size).load(rows)
+                cls.invalidate_snapshot()
+
+            return inserted
+
+    class CachedPathNode(MaterializedPathNode):
+        """A MaterializedPathNode that stores its full name and slug paths."""
+
+        name_path = models.TextField(editable=False, blank=True)
+        slug_path = models.CharField(max_length=1024, editable=False, blank=True, db_index=True)
+
+        NAME_PATH_FIELD = 'name_path'
+        SLUG_PATH_FIELD = 'slug_path'
+
+        class Meta:
+            abstract = True
+
+
+class NumberCounterModel(models.Model):
+    """Counter rows for `django_tricks.models.numbering.CounterAllocator`."""
+
+    prefix = models.CharField(max_length=100, unique=True)
+    value = models.BigIntegerField(default=0)
+
+    class Meta:
+        abstract = True
+
+    def __str__(self):
+        return '%s: %s' % (self.prefix, self.value)
+
 
 class MutableModelManager(models.QuerySet):
     def by_type(self, model_class):
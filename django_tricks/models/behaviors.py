@@ -1,43 +1,316 @@
-from django.db import models
+import copy
+from functools import wraps
+from itertools import chain
 
+from django.db import models, transaction
+from django.db.models.fields.related import lazy_related_operation
 
-class ComputeFields:
-    def contribute_to_class(self, cls, name, virtual_only=True):
-        self.model = cls
 
-        def compute_model_fields(sender, **kwargs):
-            # Filter editable fields, allow just non-editable fields
-            fields = [field for field in iter(sender._meta.local_fields) if not field.editable]
+def depends_on(*field_names):
+    """Declare the fields a `compute_<field>` method reads, so it only runs when they change.
+
+    example:
+
+        @depends_on('price', 'quantity')
+        def compute_total(self):
+            return self.price * self.quantity
+
+    """
+
+    def decorator(func):
+        func.compute_depends_on = field_names
+        return func
+
+    return decorator
+
+
+def compute_expression(expression):
+    """Declare a query expression computing the same value as the `compute_<field>` method.
+
+    The method still computes the value of single instances on save, the
+    expression is used to recompute or annotate whole querysets in the database.
 
-            # Filter fields with an existing compute method
-            fields = [field for field in fields if hasattr(sender, 'compute_%s' % field.attname)]
+    example:
 
-            for field in fields:
-                compute_func_field = 'compute_%s' % field.attname
-                instance_compute_field = getattr(self.model, compute_func_field)
+        @compute_expression(F('price') * F('quantity'))
+        def compute_total(self):
+            return self.price * self.quantity
 
-                # Creates a pre-save signal for each field that will update the value
-                def compute_field(**kwargs):
-                    instance = kwargs['instance']
-                    value = instance_compute_field(instance)
-                    setattr(instance, field.attname, value)
+    """
 
-                # Updates the receiver method to look like the instance compute field
-                compute_field.__module__ = instance_compute_field.__module__
-                compute_field.__name__ = instance_compute_field.__name__
-                compute_field.__qualname__ = instance_compute_field.__qualname__
-                compute_field.__doc__ = instance_compute_field.__doc__
-                compute_field.__annotations__ = instance_compute_field.__annotations__
+    def decorator(func):
+        func.compute_expression = expression
+        return func
 
-                models.signals.pre_save.connect(
-                    compute_field,
-                    sender=self.model,
-                    weak=False,
-                    dispatch_uid=compute_func_field)
+    return decorator
+
+
+class ComputeFields:
+    """Set every non editable field that has a `compute_<attname>` method before saving.
+
+    Compute methods decorated with `depends_on` only run for new instances or
+    when one of their input fields changed since the instance was loaded or
+    last saved. Stale computed fields are added to `update_fields` when the
+    caller saves a partial list.
+    """
+
+    def contribute_to_class(self, cls, name, virtual_only=True):
+        self.model = cls
+        self.name = name
+        setattr(cls, name, self)
 
         # Make sure it's added when all models are loaded
         models.signals.class_prepared.connect(
-            compute_model_fields,
+            self.prepare,
             sender=self.model,
             weak=False,
-            dispatch_uid='compute_%s_fields' % self.model._meta.verbose_name)
+            dispatch_uid='compute_%s_fields' % self.model._meta.label_lower)
+
+    def prepare(self, sender, **kwargs):
+        # Filter editable fields, allow just non-editable fields
+        fields = [field for field in iter(sender._meta.local_fields) if not field.editable]
+
+        # Filter fields with an existing compute method
+        fields = [field for field in fields if hasattr(sender, 'compute_%s' % field.attname)]
+
+        # (field, compute method, input attnames or None to always compute)
+        self.computes = []
+
+        for field in fields:
+            compute = getattr(sender, 'compute_%s' % field.attname)
+            depends_on = getattr(compute, 'compute_depends_on', None)
+
+            if depends_on is not None:
+                depends_on = tuple(sender._meta.get_field(name).attname for name in depends_on)
+
+            self.computes.append((field, compute, depends_on))
+
+        self.tracked = sorted(set(chain(*(depends_on or () for field, compute, depends_on in self.computes))))
+        self.state_attr = '_%s_inputs' % self.name
+
+        uid = '%s_%s' % (sender._meta.label_lower, self.name)
+        models.signals.post_init.connect(self.remember, sender=sender, weak=False, dispatch_uid=uid)
+        models.signals.pre_save.connect(self.compute_fields, sender=sender, weak=False, dispatch_uid=uid)
+        models.signals.post_save.connect(self.remember, sender=sender, weak=False, dispatch_uid=uid)
+
+        self.wrap_save(sender)
+
+    def wrap_save(self, model):
+        model_save = model.save
+
+        @wraps(model_save)
+        def save(instance, *args, **kwargs):
+            update_fields = kwargs.get('update_fields')
+
+            if update_fields is not None:
+                stale = [field.name for field, compute, depends_on in self.get_stale(instance)]
+                kwargs['update_fields'] = set(update_fields).union(stale)
+
+            return model_save(instance, *args, **kwargs)
+
+        model.save = save
+
+    def remember(self, instance, **kwargs):
+        if not self.tracked:
+            return
+
+        loaded = instance.__dict__
+        setattr(instance, self.state_attr, {
+            attname: copy.deepcopy(loaded[attname]) for attname in self.tracked if attname in loaded})
+
+    def get_stale(self, instance):
+        """Return the computes whose inputs changed, all of them for new instances."""
+        if instance._state.adding or instance.pk is None:
+            return self.computes
+
+        state = getattr(instance, self.state_attr, {})
+        loaded = instance.__dict__
+
+        def changed(attname):
+            # Fields never loaded can't have changed, fields loaded later are assumed changed
+            return attname in loaded and (attname not in state or state[attname] != loaded[attname])
+
+        return [(field, compute, depends_on) for field, compute, depends_on in self.computes
+                if depends_on is None or any(changed(attname) for attname in depends_on)]
+
+    def compute_fields(self, instance, update_fields=None, **kwargs):
+        for field, compute, depends_on in self.get_stale(instance):
+            if update_fields is not None and field.name not in update_fields:
+                continue
+            setattr(instance, field.attname, compute(instance))
+
+    def get_expressions(self, fields=None):
+        """Return a dict of field to query expression, for the computes declaring one."""
+        return {field: compute.compute_expression for field, compute, depends_on in self.computes
+                if hasattr(compute, 'compute_expression') and (fields is None or field.name in fields)}
+
+    def recompute(self, queryset=None, fields=None):
+        """Recompute the expression backed fields of the queryset with a single UPDATE.
+
+        Return the number of updated rows. Fields without a `compute_expression`
+        are left alone.
+        """
+        if queryset is None:
+            queryset = self.model._default_manager.all()
+
+        values = {field.attname: expression for field, expression in self.get_expressions(fields).items()}
+
+        if not values:
+            return 0
+
+        return queryset.update(**values)
+
+    def backfill(self, queryset, fields=None, skip_expressions=True):
+        """Run the compute methods over every row of the queryset and write the results.
+
+        Signals and `save()` are skipped, only the computed columns are
+        written. Return the number of rows processed.
+        """
+        expressions = self.get_expressions() if skip_expressions else {}
+        computes = [(field, compute) for field, compute, depends_on in self.computes
+                    if field not in expressions and (fields is None or field.name in fields)]
+
+        if not computes:
+            return 0
+
+        objs = list(queryset)
+
+        for obj in objs:
+            for field, compute in computes:
+                setattr(obj, field.attname, compute(obj))
+
+        manager = self.model._default_manager
+        field_names = [field.name for field, compute in computes]
+
+        with transaction.atomic(using=queryset.db):
+            if hasattr(manager, 'bulk_update'):
+                manager.bulk_update(objs, field_names)
+            else:
+                for obj in objs:
+                    manager.filter(pk=obj.pk).update(
+                        **{field.attname: getattr(obj, field.attname) for field, compute in computes})
+
+        return len(objs)
+
+    def annotate(self, queryset, fields=None, prefix='computed_'):
+        """Annotate the queryset with the computed values, as `<prefix><field name>`."""
+        return queryset.annotate(**{'%s%s' % (prefix, field.name): expression
+                                    for field, expression in self.get_expressions(fields).items()})
+
+
+class Rollup:
+    """Keep a subtree aggregate of a related model stored on every MPAwareModel node.
+
+    The stored column of a node counts (or sums `value_field` of) the related
+    rows pointing to the node or any of its descendants. It is updated along
+    the ancestors path when related rows are saved or deleted, so reading it
+    is a single column access.
+
+    example:
+
+        class Category(CachedPathNode):
+            product_count = models.PositiveIntegerField(default=0, editable=False)
+            products_rollup = Rollup('shop.Product', 'category', 'product_count')
+
+    Declare rollups on concrete models. `MPAwareModel.recompute_rollups()`
+    rebuilds the stored values from scratch.
+    """
+
+    AGGREGATES = ('count', 'sum')
+
+    def __init__(self, related_model, fk_name, target, aggregate='count', value_field=None):
+        if aggregate not in self.AGGREGATES:
+            raise ValueError('Unknown rollup aggregate: %s' % aggregate)
+
+        if aggregate == 'sum' and not value_field:
+            raise ValueError('Sum rollups need a value_field.')
+
+        self.related_model = related_model
+        self.fk_name = fk_name
+        self.target = target
+        self.aggregate = aggregate
+        self.value_field = value_field
+
+    def contribute_to_class(self, cls, name, virtual_only=True):
+        self.name = name
+        self.model = cls
+        self.state_attr = '_rollup_%s_state' % name
+        cls._rollups = list(getattr(cls, '_rollups', [])) + [self]
+
+        # Connect the related model signals once both models are loaded
+        lazy_related_operation(self.connect, cls, self.related_model)
+
+    def connect(self, model, related_model):
+        self.related_model = related_model
+        self.fk_attname = related_model._meta.get_field(self.fk_name).attname
+        uid = '%s.%s.%s' % (model._meta.label_lower, self.name, related_model._meta.label_lower)
+
+        models.signals.post_init.connect(self.remember, sender=related_model, weak=False, dispatch_uid=uid)
+        models.signals.post_save.connect(self.saved, sender=related_model, weak=False, dispatch_uid=uid)
+        # Before any row is deleted, the node may be deleted first when the rows cascade from it
+        models.signals.pre_delete.connect(self.deleted, sender=related_model, weak=False, dispatch_uid=uid)
+
+    def get_state(self, instance):
+        node_id = getattr(instance, self.fk_attname, None)
+
+        if self.aggregate == 'count':
+            return node_id, 1 if node_id is not None else 0
+
+        return node_id, getattr(instance, self.value_field, None) or 0
+
+    def remember(self, instance, **kwargs):
+        setattr(instance, self.state_attr, self.get_state(instance))
+
+    def saved(self, instance, created, raw=False, **kwargs):
+        if raw:
+            return
+
+        old_id, old_value = (None, 0) if created else getattr(instance, self.state_attr, (None, 0))
+        new_id, new_value = self.get_state(instance)
+
+        if old_id == new_id:
+            self.apply(new_id, new_value - old_value)
+        else:
+            self.apply(old_id, -old_value)
+            self.apply(new_id, new_value)
+
+        setattr(instance, self.state_attr, (new_id, new_value))
+
+    def deleted(self, instance, **kwargs):
+        node_id, value = getattr(instance, self.state_attr, None) or self.get_state(instance)
+        self.apply(node_id, -value)
+
+    def apply(self, node_id, delta):
+        """Add delta to the node and all its ancestors, in a single UPDATE."""
+        if node_id is None or not delta:
+            return
+
+        manager = self.model._default_manager
+        path = manager.filter(pk=node_id).values_list('path', flat=True).first()
+
+        if path:
+            self.apply_to_path(path, delta)
+
+    def apply_to_path(self, path, delta, include_self=True):
+        steplen = self.model.steplen
+        end = len(path) + 1 if include_self else len(path)
+        paths = [path[:position] for position in range(steplen, end, steplen)]
+
+        if paths:
+            self.model._default_manager.filter(path__in=paths).update(
+                **{self.target: models.F(self.target) + delta})
+
+    def get_node_values(self):
+        """Return a dict with the aggregate of the rows pointing directly to every node."""
+        if self.aggregate == 'count':
+            aggregate = models.Count('pk')
+        else:
+            aggregate = models.Sum(self.value_field)
+
+        rows = (self.related_model._default_manager
+                .filter(**{'%s__isnull' % self.fk_name: False})
+                .order_by()
+                .values_list(self.fk_attname)
+                .annotate(total=aggregate))
+
+        return {node_id: total or 0 for node_id, total in rows}
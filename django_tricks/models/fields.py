@@ -1,29 +1,158 @@
 import os
 import string
+import sys
+from collections import namedtuple
+from functools import lru_cache
 from itertools import chain
 
 from django.conf import settings
 from django.contrib.auth.hashers import mask_hash
-from django.contrib.postgres.fields import ArrayField
-from django.contrib.postgres.forms import SimpleArrayField
+from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator, MaxValueValidator
-from django.db.models import FloatField, CharField, SlugField, PositiveIntegerField
-from django.forms import widgets
+from django.db import transaction
+from django.db.models import (Avg, BigIntegerField, F, FloatField, CharField, Lookup, Max, Min,
+                              PositiveIntegerField, QuerySet, Sum)
+from django.forms import MultipleChoiceField, widgets
+from django.forms.utils import flatatt
 from django.utils.crypto import get_random_string
-from django.utils.functional import curry
+from django.utils.encoding import force_text
+from django.utils.functional import cached_property, curry, lazy
 from django.utils.html import format_html
 from django.utils.safestring import mark_safe
-from django.utils.translation import gettext_lazy as _
-from pint import UnitRegistry
-from pytz import common_timezones
+from django.utils.translation import get_language, gettext, gettext_lazy as _
 
 from django_tricks.utils.luhncode import LuhnCodeGenerator
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
-TIMEZONE_CHOICES = [(timezone, timezone) for timezone in common_timezones]
+# The pint registry, the pytz timezones and the postgres fields are costly to
+# import, they are loaded on first use so importing this module stays cheap.
+LAZY_FLAGS_NAMES = ('SimpleFlagField', 'FlagsField', 'FlagsQuerySet')
 
-ureg = UnitRegistry(system='mks')
+
+def __getattr__(name):
+    # Python 3.7+ (PEP 562), older versions import the flags at the end of the module
+    if name in LAZY_FLAGS_NAMES:
+        from django_tricks.models import flags
+        return getattr(flags, name)
+    raise AttributeError('module %r has no attribute %r' % (__name__, name))
+
+
+@lru_cache(maxsize=None)
+def get_unit_registry():
+    from pint import UnitRegistry
+    return UnitRegistry(system='mks')
+
+
+@lru_cache(maxsize=None)
+def get_timezone_choices():
+    from pytz import common_timezones
+    return tuple((timezone, timezone) for timezone in common_timezones)
+
+
+class LazyUnitRegistry:
+    """Stand for the pint registry, built on first use."""
+
+    def __getattr__(self, name):
+        return getattr(get_unit_registry(), name)
+
+    def __call__(self, *args, **kwargs):
+        return get_unit_registry()(*args, **kwargs)
+
+
+class LazyChoices:
+    """A choices sequence built by `loader` the first time it is iterated."""
+
+    def __init__(self, loader):
+        self.loader = loader
+
+    def __bool__(self):
+        return True
+
+    def __iter__(self):
+        return iter(self.loader())
+
+    def __len__(self):
+        return len(self.loader())
+
+    def __getitem__(self, index):
+        return self.loader()[index]
+
+    def __eq__(self, other):
+        return tuple(self) == tuple(other)
+
+    def __hash__(self):
+        return hash(tuple(self))
+
+
+ureg = LazyUnitRegistry()
+TIMEZONE_CHOICES = LazyChoices(get_timezone_choices)
+
+
+class UnitDimensionError(ValueError):
+    """A quantity can't be converted to the unit of a UnitField."""
+    pass
+
+
+class UnitValue(namedtuple('UnitValue', ['magnitude', 'symbol'])):
+    """A lightweight float and unit symbol pair, for hot paths that don't need pint."""
+
+    __slots__ = ()
+
+    def __str__(self):
+        return '%s %s' % (self.magnitude, self.symbol)
+
+    def __float__(self):
+        return float(self.magnitude)
+
+    def to_quantity(self):
+        return self.magnitude * get_unit_registry()(self.symbol)
+
+
+class UnitQuerySet(QuerySet):
+    def quantities(self, field_name, unit=None):
+        """Return the UnitField column as a single pint Quantity wrapping a NumPy array.
+
+        Null values become NaN. When unit is given the whole array is converted
+        with a single vectorized multiplication.
+        """
+        import numpy
+
+        field = self.model._meta.get_field(field_name)
+        values = self.values_list(field.attname, flat=True)
+        magnitudes = numpy.fromiter((numpy.nan if value is None else value for value in values.iterator()),
+                                    dtype=float)
+        quantity = get_unit_registry().Quantity(magnitudes, field.unit_name)
+
+        if unit is not None:
+            quantity = quantity.to(unit)
+
+        return quantity
+
+    def aggregate_quantities(self, *args, **kwargs):
+        """Like `aggregate()`, but Sum, Avg, Min and Max over a UnitField return pint quantities."""
+        result = self.aggregate(*args, **kwargs)
+        aggregates = dict(kwargs, **{arg.default_alias: arg for arg in args})
+
+        for alias, aggregate in aggregates.items():
+            if not isinstance(aggregate, (Sum, Avg, Min, Max)) or result.get(alias) is None:
+                continue
+
+            source = aggregate.get_source_expressions()[0]
+
+            if isinstance(source, F):
+                field = self.model._meta.get_field(source.name)
+                if isinstance(field, UnitField):
+                    result[alias] = result[alias] * field.unit
+
+        return result
+
+    def unit_values(self, field_name):
+        """Return the UnitField column as a list of UnitValue, without creating pint objects."""
+        field = self.model._meta.get_field(field_name)
+        symbol = field.symbol
+        return [None if value is None else UnitValue(value, symbol)
+                for value in self.values_list(field.attname, flat=True)]
 
 
 class UnitField(FloatField):
@@ -33,13 +162,20 @@ class UnitField(FloatField):
         if unit is None:
             raise ValueError('Missing unit definition.')
 
-        self.unit = ureg(unit)
-        self.symbol = ureg.get_symbol(unit)
+        self.unit_name = unit
 
         super(UnitField, self).__init__(*args, **kwargs)
 
         if not self.help_text:
-            self.help_text = _('Value in {}').format(self.symbol)
+            self.help_text = lazy(lambda: gettext('Value in {}').format(self.symbol), str)()
+
+    @cached_property
+    def unit(self):
+        return get_unit_registry()(self.unit_name)
+
+    @cached_property
+    def symbol(self):
+        return get_unit_registry().get_symbol(self.unit_name)
 
     def deconstruct(self):
         name, path, args, kwargs = super(UnitField, self).deconstruct()
@@ -51,6 +187,22 @@ class UnitField(FloatField):
             return value * self.unit
         return value
 
+    def get_prep_value(self, value):
+        # Quantities are converted to the stored unit once, when the query is
+        # built, so lookups like `distance__gt=Q_(5, 'km')` keep the column bare.
+        if hasattr(value, 'magnitude') and hasattr(value, 'to'):
+            value = self.to_magnitude(value)
+        return super(UnitField, self).get_prep_value(value)
+
+    def to_magnitude(self, quantity):
+        from pint.errors import DimensionalityError
+
+        try:
+            return quantity.to(self.unit_name).magnitude
+        except DimensionalityError:
+            raise UnitDimensionError('Can not use %s with %s.%s, it is stored in %s (%s).' % (
+                quantity, self.model.__name__, self.name, self.symbol, self.unit.dimensionality))
+
     def formfield(self, **defaults):
         attrs = {'type': 'number',
                  'step': 'any'}
@@ -69,16 +221,100 @@ class UnitField(FloatField):
         return super(UnitField, self).formfield(**defaults)
 
 
+class CachedChoicesSelect(widgets.Select):
+    """A Select for large static choice sets that renders the options HTML once.
+
+    The options are rendered once per `cache_key` and language, each render
+    only inserts the `selected` attribute in the cached HTML. Without a
+    `cache_key` it renders as a regular Select.
+    """
+
+    rendered_options = {}
+
+    def __init__(self, attrs=None, choices=(), cache_key=None):
+        super(CachedChoicesSelect, self).__init__(attrs, choices)
+        self.cache_key = cache_key
+
+    def get_rendered_options(self):
+        choices = self.choices
+        key = (self.cache_key, get_language(), len(choices), choices[0][0] if choices else None)
+        rendered = self.rendered_options.get(key)
+
+        if rendered is None:
+            rendered = self.rendered_options[key] = self.render_options_html(choices)
+
+        return rendered
+
+    def render_options_html(self, choices):
+        """Return the options HTML and the offset where `selected` goes for every value."""
+        parts, positions, size = [], {}, 0
+
+        def add(html):
+            nonlocal size
+            parts.append(html)
+            size += len(html)
+
+        def add_option(value, label):
+            add(format_html('<option value="{}"', value))
+            positions.setdefault(force_text(value), size)
+            add(format_html('>{}</option>\n', label))
+
+        for value, label in choices:
+            if isinstance(label, (list, tuple)):
+                add(format_html('<optgroup label="{}">\n', value))
+                for option_value, option_label in label:
+                    add_option(option_value, option_label)
+                add('</optgroup>\n')
+            else:
+                add_option(value, label)
+
+        return ''.join(parts), positions
+
+    def render(self, name, value, attrs=None, renderer=None):
+        if self.cache_key is None:
+            return super(CachedChoicesSelect, self).render(name, value, attrs, renderer)
+
+        html, positions = self.get_rendered_options()
+        values = value if isinstance(value, (list, tuple)) else [value]
+        # As Select.format_value, None selects the blank choice
+        selected = ('' if v is None else force_text(v) for v in values)
+        offsets = sorted({positions[v] for v in selected if v in positions})
+
+        chunks, last = [], 0
+
+        for offset in offsets:
+            chunks.extend((html[last:offset], ' selected="selected"'))
+            last = offset
+
+        chunks.append(html[last:])
+
+        final_attrs = dict(self.attrs, **(attrs or {}))
+        final_attrs['name'] = name
+
+        return format_html('<select{}>\n{}</select>', flatatt(final_attrs), mark_safe(''.join(chunks)))
+
+
 class TimezoneChoiceField(CharField):
     def __init__(self, *args, **kwargs):
         kwargs.setdefault('max_length', 200)
-        kwargs['choices'] = TIMEZONE_CHOICES
+        kwargs['choices'] = LazyChoices(get_timezone_choices)
         super().__init__(*args, **kwargs)
 
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        kwargs['choices'] = list(get_timezone_choices())
+        return name, path, args, kwargs
+
+    def formfield(self, **kwargs):
+        kwargs.setdefault('widget', CachedChoicesSelect(cache_key='timezones'))
+        return super().formfield(**kwargs)
+
 
 class FlagsCheckboxSelectMultiple(widgets.CheckboxSelectMultiple):
     def __init__(self, *args, **kwargs):
-        self.queryset = kwargs.pop('queryset')
+        self.vocabulary = kwargs.pop('vocabulary', None)
+        self.queryset = kwargs.pop('queryset', None)
+        self.allow_new = kwargs.pop('allow_new', True)
         super(FlagsCheckboxSelectMultiple, self).__init__(*args, **kwargs)
 
     def value_from_datadict(self, data, files, name):
@@ -93,19 +329,30 @@ class FlagsCheckboxSelectMultiple(widgets.CheckboxSelectMultiple):
         return value
 
     def append_choices(self, field_name, choices):
+        values = [value for value, label in choices]
+
+        if not self.allow_new:
+            return list(choices)
+
+        if self.vocabulary is not None:
+            flags = [flag for flag, count in self.vocabulary.flags() if flag not in values]
+            return list(chain(choices, [(value, value.title()) for value in flags]))
+
         flags = self.queryset.values_list(field_name, flat=True)
         flags = filter(lambda f: f is not None, flags)  # Remove empty lists
         flags = chain(*flags)  # Concatenate lists
         flags = set(flags)  # Remove duplicates
-
-        values = [value for value, label in choices]
         flags = filter(lambda flag: flag not in values, flags)
 
         return list(chain(choices, [(value, value.title()) for value in flags]))
 
-    def render(self, name, value, attrs=None, choices=()):
+    def render(self, name, value, attrs=None, renderer=None):
         self.choices = self.append_choices(name, self.choices)
-        output = super(FlagsCheckboxSelectMultiple, self).render(name, value, attrs, choices)
+        output = super(FlagsCheckboxSelectMultiple, self).render(name, value, attrs, renderer)
+
+        if not self.allow_new:
+            return output
+
         output += format_html('<ul><li><label for="id_add_flag">Add a new flag(s)</label><br>'
                               '<input id="id_{0}_add" name="{0}_add" type="text" '
                               'class="vTextField" maxlength="140" '
@@ -115,41 +362,144 @@ class FlagsCheckboxSelectMultiple(widgets.CheckboxSelectMultiple):
         return mark_safe(output)
 
 
-class SimpleFlagField(SimpleArrayField):
+class BitFlagsFormField(MultipleChoiceField):
     def to_python(self, value):
-        if isinstance(value, (list, tuple)):
-            value = ', '.join(value)
-        return super().to_python(value)
+        if isinstance(value, str):
+            value = [flag.strip() for flag in value.split(',') if flag.strip()]
+        return super(BitFlagsFormField, self).to_python(value)
 
-    def prepare_value(self, value):
-        value = super(SimpleFlagField, self).prepare_value(value)
-        if value:
-            return value.split(',')
-        return value
 
+class BitFlagsField(BigIntegerField):
+    """Store a fixed vocabulary of up to 64 flags as a bigint bitmask.
 
-class FlagsField(ArrayField):
-    def __init__(self, flags, size=None, **kwargs):
-        base_field = SlugField(max_length=10, blank=True)
-        self.flags = flags
-        super(FlagsField, self).__init__(base_field=base_field, size=size, **kwargs)
+    Takes the same `flags` choices as FlagsField and returns the list of set
+    flags, in the `flags` order. Filter with `has_flag`, `has_all_flags` and
+    `has_any_flags`, which compile to bitwise operations on any database.
+    """
 
-    def formfield(self, **kwargs):
-        defaults = {'form_class': SimpleFlagField,
-                    'widget': FlagsCheckboxSelectMultiple(
-                        choices=self.flags,
-                        queryset=self.model._default_manager.filter())}
+    MAX_FLAGS = 64
 
-        defaults.update(kwargs)
-        return super().formfield(**defaults)
+    def __init__(self, flags, **kwargs):
+        if len(flags) > self.MAX_FLAGS:
+            raise ValueError('BitFlagsField supports up to %s flags.' % self.MAX_FLAGS)
+
+        self.flags = flags
+        self.flag_bits = {flag: 1 << position for position, (flag, label) in enumerate(flags)}
+        kwargs.setdefault('default', list)
+        kwargs.setdefault('blank', True)
+        super(BitFlagsField, self).__init__(**kwargs)
 
     def deconstruct(self):
-        name, path, args, kwargs = super().deconstruct()
-        del kwargs['size']
-        del kwargs['base_field']
+        name, path, args, kwargs = super(BitFlagsField, self).deconstruct()
         kwargs['flags'] = self.flags
         return name, path, args, kwargs
 
+    @cached_property
+    def validators(self):
+        # Values are flag lists, the bigint range validators only apply to the stored mask
+        return list(chain(self.default_validators, self._validators))
+
+    def to_mask(self, flags):
+        """Return the signed 64 bits mask of the flags."""
+        try:
+            mask = sum(self.flag_bits[flag] for flag in set(flags))
+        except KeyError as err:
+            raise ValueError('Unknown flag %s for %s.' % (err, self.name))
+        return mask - (1 << 64) if mask >= 1 << 63 else mask
+
+    def to_flags(self, mask):
+        mask &= (1 << 64) - 1
+        return [flag for flag, label in self.flags if mask & self.flag_bits[flag]]
+
+    def from_db_value(self, value, expression, connection, context):
+        if value is None:
+            return value
+        return self.to_flags(value)
+
+    def to_python(self, value):
+        if value is None or isinstance(value, list):
+            return value
+        if isinstance(value, int):
+            return self.to_flags(value)
+        if isinstance(value, str):
+            return [flag.strip() for flag in value.split(',') if flag.strip()]
+        return list(value)
+
+    def get_prep_value(self, value):
+        if value is None or isinstance(value, int):
+            return value
+        return self.to_mask(self.to_python(value))
+
+    def validate(self, value, model_instance):
+        super(BitFlagsField, self).validate(value, model_instance)
+        unknown = set(value or ()) - set(self.flag_bits)
+        if unknown:
+            raise ValidationError(_('Unknown flags: %(flags)s'), params={'flags': ', '.join(sorted(unknown))})
+
+    def formfield(self, **kwargs):
+        defaults = {'form_class': BitFlagsFormField,
+                    'choices': self.flags,
+                    'required': not self.blank,
+                    'widget': FlagsCheckboxSelectMultiple(choices=self.flags, allow_new=False)}
+        defaults.update(kwargs)
+        form_class = defaults.pop('form_class')
+        return form_class(**defaults)
+
+
+class BitFlagsLookup(Lookup):
+    template = '(%(lhs)s & %(rhs)s) = %(rhs)s'
+
+    def get_prep_lookup(self):
+        flags = [self.rhs] if isinstance(self.rhs, str) else list(self.rhs)
+        return self.lhs.output_field.get_prep_value(flags)
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        sql = self.template % {'lhs': lhs, 'rhs': rhs}
+        return sql, list(lhs_params) + list(rhs_params) * self.template.count('%(rhs)s')
+
+
+@BitFlagsField.register_lookup
+class BitHasFlag(BitFlagsLookup):
+    lookup_name = 'has_flag'
+
+
+@BitFlagsField.register_lookup
+class BitHasAllFlags(BitFlagsLookup):
+    lookup_name = 'has_all_flags'
+
+
+@BitFlagsField.register_lookup
+class BitHasAnyFlags(BitFlagsLookup):
+    lookup_name = 'has_any_flags'
+    template = '(%(lhs)s & %(rhs)s) <> 0'
+
+
+def copy_flags_to_bits(queryset, source, target, chunk_size=1000):
+    """Copy a FlagsField column into a BitFlagsField column, to migrate from one to the other.
+
+    Use it from a RunPython data migration, between adding the BitFlagsField
+    and removing the FlagsField. Flags missing from the BitFlagsField
+    vocabulary raise a ValueError. Return the number of copied rows.
+    """
+    field = queryset.model._meta.get_field(target)
+    rows = queryset.order_by('pk').values_list('pk', source)
+    last_pk, copied = None, 0
+
+    while True:
+        chunk = list((rows.filter(pk__gt=last_pk) if last_pk is not None else rows)[:chunk_size])
+
+        if not chunk:
+            return copied
+
+        with transaction.atomic(using=queryset.db):
+            for pk, flags in chunk:
+                queryset.filter(pk=pk).update(**{target: field.to_mask(flags or [])})
+
+        last_pk = chunk[-1][0]
+        copied += len(chunk)
+
 
 class NumberField(PositiveIntegerField):
     def formfield(self, **defaults):
@@ -178,12 +528,88 @@ class PositiveNumberField(PositiveIntegerField):
     default_validators = [MinValueValidator(0)]
 
 
-class UppercaseCharField(CharField):
+class NormalizedCharField(CharField):
+    """A CharField that normalizes its value when written and in lookup parameters.
+
+    Stored data is normalized, so plain equality filters use the regular btree
+    index instead of `UPPER(col)` like scans. Run the `normalize_char_fields`
+    command to normalize the rows written before using the field.
+
+    While `normalize_reads` is on, the rows are not assumed normalized yet:
+    values read are normalized per row and lookup parameters are left as given.
+    """
+
+    # Also normalize values read from the database, for not yet migrated data
+    normalize_reads = False
+
+    def __init__(self, *args, **kwargs):
+        self.normalize_reads = kwargs.pop('normalize_reads', self.normalize_reads)
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        if self.normalize_reads != type(self).normalize_reads:
+            kwargs['normalize_reads'] = self.normalize_reads
+        return name, path, args, kwargs
+
+    def normalize(self, value):
+        raise NotImplementedError('Implement and return the normalized value')
+
     def from_db_value(self, value, expression, connection, context):
         if isinstance(value, str):
-            return value.upper()
-        else:
-            return value
+            return self.normalize(value)
+        return value
+
+    def get_db_converters(self, connection):
+        converters = super().get_db_converters(connection)
+        if not self.normalize_reads:
+            # Stored data is normalized, don't pay a converter call per row
+            converters = [converter for converter in converters if converter != self.from_db_value]
+        return converters
+
+    def get_prep_value(self, value):
+        value = super().get_prep_value(value)
+        if isinstance(value, str) and not self.normalize_reads:
+            return self.normalize(value)
+        return value
+
+    def get_db_prep_save(self, value, connection):
+        # Written values are always normalized, update() included
+        if isinstance(value, str):
+            value = self.normalize(value)
+        return super().get_db_prep_save(value, connection)
+
+    def pre_save(self, model_instance, add):
+        value = super().pre_save(model_instance, add)
+        if isinstance(value, str):
+            value = self.normalize(value)
+            setattr(model_instance, self.attname, value)
+        return value
+
+
+class UpperCharField(NormalizedCharField):
+    def normalize(self, value):
+        return value.upper()
+
+
+class LowerCharField(NormalizedCharField):
+    def normalize(self, value):
+        return value.lower()
+
+
+class CaseFoldCharField(NormalizedCharField):
+    def normalize(self, value):
+        return value.casefold()
+
+
+class CollapsedWhitespaceCharField(NormalizedCharField):
+    def normalize(self, value):
+        return ' '.join(value.split())
+
+
+class UppercaseCharField(UpperCharField):
+    # Kept uppercasing on read, set `normalize_reads=False` once the rows are normalized
+    normalize_reads = True
 
 
 class DefaultRandomCharField(CharField):
@@ -236,3 +662,11 @@ class LuhnCodeRandomField(DefaultRandomCharField):
     def contribute_to_class(self, cls, name, virtual_only=False):
         super(LuhnCodeRandomField, self).contribute_to_class(cls, name, virtual_only=virtual_only)
         setattr(cls, 'get_%s_mask', curry(self.get_FIELD_mask, field=self))
+
+
+if sys.version_info < (3, 7):
+    try:
+        from django_tricks.models.flags import FlagsField, FlagsQuerySet, SimpleFlagField  # noqa: F401
+    except ImportError:
+        # psycopg2 is missing
+        pass
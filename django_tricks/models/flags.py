@@ -0,0 +1,259 @@
+import uuid
+
+from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.fields.array import ArrayContains, ArrayOverlap
+from django.contrib.postgres.forms import SimpleArrayField
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet, ImproperlyConfigured
+from django.db import connections, transaction
+from django.db.models import QuerySet, SlugField, signals
+
+from django_tricks.models.fields import FlagsCheckboxSelectMultiple
+
+
+def flag_counts(queryset, field_name):
+    """Return a dict of flag to the number of rows of the queryset using it, in one query."""
+    field = queryset.model._meta.get_field(field_name)
+    connection = connections[queryset.db]
+
+    try:
+        query, params = queryset.order_by().values_list(field.attname).query.sql_with_params()
+    except EmptyResultSet:
+        return {}
+
+    sql = ('SELECT flag, COUNT(*) FROM (SELECT unnest(t.{column}) AS flag FROM ({query}) AS t) AS flags '
+           'GROUP BY flag').format(column=connection.ops.quote_name(field.column), query=query)
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return dict(cursor.fetchall())
+
+
+class FlagsQuerySet(QuerySet):
+    def flag_counts(self, field_name='flags'):
+        return flag_counts(self, field_name)
+
+
+class FlagVocabulary:
+    """The distinct flags used by a FlagsField, with how many rows use each one.
+
+    Counts live in the default cache, one key per flag. They are built once with
+    a `SELECT unnest(...)` and then kept up to date from the field changes on
+    save and delete, so reading the vocabulary never scans the table. A flag
+    seen for the first time is claimed with `cache.add` and given the next slot
+    of the names list, so concurrent writers never overwrite each other.
+    Instances loaded with the field deferred, and queryset `update()` or
+    `delete()`, don't update the counts: `rebuild()` starts over from the table.
+    """
+
+    def __init__(self, model, field):
+        self.model = model
+        self.field = field
+        self.key_prefix = 'django_tricks:flags:%s.%s' % (model._meta.label_lower, field.attname)
+        self.generation_key = '%s:generation' % self.key_prefix
+        self.state_attr = '_%s_flags_state' % field.attname
+
+    def count_key(self, generation, flag):
+        return '%s:%s:count:%s' % (self.key_prefix, generation, flag)
+
+    def name_key(self, generation, slot):
+        return '%s:%s:name:%s' % (self.key_prefix, generation, slot)
+
+    def size_key(self, generation):
+        return '%s:%s:size' % (self.key_prefix, generation)
+
+    def rebuild(self):
+        counts = flag_counts(self.model._default_manager.all(), self.field.name)
+        # A new generation of keys, so counters of the previous one can't leak in
+        generation = uuid.uuid4().hex
+
+        values = {self.count_key(generation, flag): count for flag, count in counts.items()}
+        values.update({self.name_key(generation, slot): flag for slot, flag in enumerate(counts, 1)})
+        values[self.size_key(generation)] = len(counts)
+        cache.set_many(values, None)
+        cache.set(self.generation_key, generation, None)
+        return counts
+
+    def counts(self):
+        """Return a dict of flag to the number of rows using it."""
+        generation = cache.get(self.generation_key)
+        size = cache.get(self.size_key(generation)) if generation else None
+
+        if size is None:
+            return self.rebuild()
+
+        names = set(cache.get_many([self.name_key(generation, slot) for slot in range(1, size + 1)]).values())
+        values = cache.get_many([self.count_key(generation, flag) for flag in names])
+
+        if len(values) < len(names):
+            # Evicted keys
+            return self.rebuild()
+
+        return {flag: values[self.count_key(generation, flag)] for flag in names
+                if values[self.count_key(generation, flag)] > 0}
+
+    def flags(self):
+        """Return the used flags, the most used first."""
+        return sorted(self.counts().items(), key=lambda item: (-item[1], item[0]))
+
+    def update(self, added, removed):
+        generation = cache.get(self.generation_key)
+
+        if generation is None:
+            # Not built yet, the next read will query the table
+            return
+
+        for flag in removed:
+            try:
+                cache.decr(self.count_key(generation, flag))
+            except ValueError:
+                pass
+
+        for flag in added:
+            self.increment(generation, flag)
+
+    def increment(self, generation, flag):
+        key = self.count_key(generation, flag)
+
+        if cache.add(key, 0, None):
+            # First use of the flag, only one writer gets here
+            try:
+                slot = cache.incr(self.size_key(generation))
+            except ValueError:
+                return
+            cache.set(self.name_key(generation, slot), flag, None)
+
+        try:
+            cache.incr(key)
+        except ValueError:
+            pass
+
+    def remember(self, instance, **kwargs):
+        if self.field.attname in instance.__dict__:
+            setattr(instance, self.state_attr, list(getattr(instance, self.field.attname) or []))
+
+    def saved(self, instance, created, raw=False, update_fields=None, **kwargs):
+        if self.field.attname not in instance.__dict__:
+            # Deferred and not saved
+            return
+
+        if update_fields is not None and self.field.name not in update_fields:
+            return
+
+        new = set(getattr(instance, self.field.attname) or [])
+        old = set() if created else getattr(instance, self.state_attr, None)
+        setattr(instance, self.state_attr, list(new))
+
+        if old is None:
+            # Loaded with the field deferred, the stored flags are unknown
+            return
+
+        old = set(old)
+
+        if old != new:
+            transaction.on_commit(lambda: self.update(new - old, old - new))
+
+    def deleted(self, instance, **kwargs):
+        old = set(getattr(instance, self.state_attr, None) or [])
+
+        if old:
+            transaction.on_commit(lambda: self.update(set(), old))
+
+    def connect(self):
+        uid = self.key_prefix
+        signals.post_init.connect(self.remember, sender=self.model, weak=False, dispatch_uid=uid)
+        signals.post_save.connect(self.saved, sender=self.model, weak=False, dispatch_uid=uid)
+        signals.post_delete.connect(self.deleted, sender=self.model, weak=False, dispatch_uid=uid)
+
+
+class SimpleFlagField(SimpleArrayField):
+    def to_python(self, value):
+        if isinstance(value, (list, tuple)):
+            value = ', '.join(value)
+        return super().to_python(value)
+
+    def prepare_value(self, value):
+        value = super(SimpleFlagField, self).prepare_value(value)
+        if value:
+            return value.split(',')
+        return value
+
+
+class FlagsField(ArrayField):
+    def __init__(self, flags, size=None, gin_index=False, **kwargs):
+        base_field = SlugField(max_length=10, blank=True)
+        self.flags = flags
+        self.gin_index = gin_index
+        super(FlagsField, self).__init__(base_field=base_field, size=size, **kwargs)
+
+    def contribute_to_class(self, cls, name, **kwargs):
+        super(FlagsField, self).contribute_to_class(cls, name, **kwargs)
+
+        if not cls._meta.abstract:
+            self.vocabulary = FlagVocabulary(cls, self)
+            self.vocabulary.connect()
+
+            if self.gin_index:
+                self.add_gin_index(cls)
+
+    def add_gin_index(self, cls):
+        """Declare a GIN index in the model Meta, so it's created by the migrations."""
+        try:
+            from django.contrib.postgres.indexes import GinIndex
+        except ImportError:
+            raise ImproperlyConfigured('FlagsField(gin_index=True) needs Django 1.11 or later.')
+
+        if not any(isinstance(index, GinIndex) and index.fields == [self.name]
+                   for index in cls._meta.indexes):
+            cls._meta.indexes = list(cls._meta.indexes) + [GinIndex(fields=[self.name])]
+
+    def formfield(self, **kwargs):
+        defaults = {'form_class': SimpleFlagField,
+                    'widget': FlagsCheckboxSelectMultiple(
+                        choices=self.flags,
+                        vocabulary=self.vocabulary)}
+
+        defaults.update(kwargs)
+        return super().formfield(**defaults)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        del kwargs['size']
+        del kwargs['base_field']
+        kwargs['flags'] = self.flags
+        if self.gin_index:
+            kwargs['gin_index'] = True
+        return name, path, args, kwargs
+
+
+@FlagsField.register_lookup
+class HasFlag(ArrayContains):
+    """`flags__has_flag='new'`, compiles to the GIN indexable `flags @> ARRAY['new']`."""
+
+    lookup_name = 'has_flag'
+
+    def get_prep_lookup(self):
+        self.rhs = [self.rhs]
+        return super(HasFlag, self).get_prep_lookup()
+
+
+@FlagsField.register_lookup
+class HasAllFlags(ArrayContains):
+    """`flags__has_all_flags=['new', 'sale']`, compiles to `flags @> ARRAY[...]`."""
+
+    lookup_name = 'has_all_flags'
+
+    def get_prep_lookup(self):
+        self.rhs = list(self.rhs)
+        return super(HasAllFlags, self).get_prep_lookup()
+
+
+@FlagsField.register_lookup
+class HasAnyFlags(ArrayOverlap):
+    """`flags__has_any_flags=['new', 'sale']`, compiles to `flags && ARRAY[...]`."""
+
+    lookup_name = 'has_any_flags'
+
+    def get_prep_lookup(self):
+        self.rhs = list(self.rhs)
+        return super(HasAnyFlags, self).get_prep_lookup()
@@ -1,8 +1,15 @@
 from itertools import chain
 
 from django.conf import settings
+from django.core.exceptions import NON_FIELD_ERRORS, ValidationError
+from django.db import IntegrityError, router, transaction
+from django.db.models import CharField, F, Value
+from django.db.models.functions import Concat, Substr
 from django.utils import six
 from django.utils.encoding import python_2_unicode_compatible
+from django.utils.translation import gettext_lazy as _
+
+from .trees import tree_snapshots
 
 
 @python_2_unicode_compatible
@@ -36,15 +43,136 @@ class VerboseNameModel(object):
 
 
 class ValidateModel(object):
+    """Run `full_clean()` before saving.
+
+    VALIDATE_UNIQUE = False skips the uniqueness SELECTs for constraints the
+    database already enforces and turns the IntegrityError into a
+    ValidationError instead. VALIDATE_CHANGED_ONLY = True only validates the
+    fields changed since the instance was loaded.
+    """
+
+    VALIDATE_UNIQUE = True
+    VALIDATE_CHANGED_ONLY = False
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(ValidateModel, cls).from_db(db, field_names, values)
+        if cls.VALIDATE_CHANGED_ONLY:
+            instance._loaded_values = {field.attname: getattr(instance, field.attname)
+                                       for field in cls._meta.concrete_fields
+                                       if field.attname in instance.__dict__}
+        return instance
+
+    def get_unchanged_fields(self):
+        loaded = getattr(self, '_loaded_values', None)
+
+        if not loaded or self._state.adding:
+            return []
+
+        return [field.name for field in self._meta.concrete_fields
+                if field.attname in loaded and loaded[field.attname] == getattr(self, field.attname)]
+
+    def get_date_errors(self, exclude=None):
+        """Run the unique_for_date/month/year checks, the database doesn't enforce them."""
+        unique_checks, date_checks = self._get_unique_checks(exclude=exclude)
+        return self._perform_date_checks(date_checks) if date_checks else {}
+
     def save(self, *args, **kwargs):
-        self.full_clean()
-        super(ValidateModel, self).save(*args, **kwargs)
+        exclude = self.get_unchanged_fields() if self.VALIDATE_CHANGED_ONLY else None
+        self.full_clean(exclude=exclude, validate_unique=self.VALIDATE_UNIQUE)
+
+        if self.VALIDATE_UNIQUE:
+            super(ValidateModel, self).save(*args, **kwargs)
+        else:
+            errors = self.get_date_errors(exclude)
+            if errors:
+                raise ValidationError(errors)
+
+            using = kwargs.get('using') or router.db_for_write(type(self), instance=self)
+
+            try:
+                with transaction.atomic(using=using):
+                    super(ValidateModel, self).save(*args, **kwargs)
+            except IntegrityError as err:
+                raise ValidationError(_('%(model)s violates a database constraint: %(error)s'),
+                                      code='integrity',
+                                      params={'model': self._meta.verbose_name, 'error': err})
+
+        if self.VALIDATE_CHANGED_ONLY:
+            self._loaded_values = {field.attname: getattr(self, field.attname)
+                                   for field in self._meta.concrete_fields}
+
+    @classmethod
+    def get_unique_clashes(cls, objs, names):
+        """Return the positions of the instances whose values of the unique field names
+        already exist in the table or earlier in the batch, with a single query.
+        """
+        attnames = [cls._meta.get_field(name).attname for name in names]
+        keys = [tuple(getattr(obj, attname) for attname in attnames) for obj in objs]
+        candidates = [key for key in keys if None not in key]
+
+        if not candidates:
+            return []
+
+        lookups = {'%s__in' % attname: {key[position] for key in candidates}
+                   for position, attname in enumerate(attnames)}
+        existing = set(cls._default_manager.filter(**lookups).values_list(*attnames))
+        clashes, seen = [], set()
+
+        for index, key in enumerate(keys):
+            if None in key:
+                continue
+            if key in existing or key in seen:
+                clashes.append(index)
+            seen.add(key)
+
+        return clashes
+
+    @classmethod
+    def bulk_full_clean(cls, objs):
+        """Validate a batch of unsaved instances, for `bulk_create`.
+
+        Field validation runs per instance, uniqueness is checked with one IN
+        query per unique field or unique_together, plus duplicates inside the
+        batch. Raise a ValidationError keyed by the position of the invalid
+        instances, with the messages prefixed by their field name.
+        """
+        errors = {}
+
+        for index, obj in enumerate(objs):
+            try:
+                obj.full_clean(validate_unique=False)
+            except ValidationError as err:
+                errors[index] = err.message_dict
+
+            for field, messages in obj.get_date_errors().items():
+                errors.setdefault(index, {}).setdefault(field, []).extend(
+                    message.messages[0] for message in messages)
+
+        opts = cls._meta
+        constraints = [(field.name,) for field in opts.local_fields if field.unique and not field.primary_key]
+        constraints += [tuple(fields) for fields in opts.unique_together]
+
+        for names in constraints:
+            for index in cls.get_unique_clashes(objs, names):
+                message = objs[index].unique_error_message(cls, names).messages[0]
+                errors.setdefault(index, {}).setdefault(NON_FIELD_ERRORS, []).append(message)
+
+        if errors:
+            # ValidationError can't nest dicts, prefix the messages with their field
+            raise ValidationError({
+                index: ['%s%s' % ('' if field == NON_FIELD_ERRORS else '%s: ' % field, message)
+                        for field, messages in fields.items() for message in messages]
+                for index, fields in errors.items()})
 
 
 class AutoNumberModel(object):
     NUMBER_FIELD = 'number'
     NUMBER_AUTO = True
 
+    # A django_tricks.models.numbering allocator, used by pop_next_number_value
+    NUMBER_ALLOCATOR = None
+
     def __init__(self, *args, **kwargs):
         super(AutoNumberModel, self).__init__(*args, **kwargs)
         if not hasattr(self, self.NUMBER_FIELD):
@@ -62,11 +190,16 @@ class AutoNumberModel(object):
         return self.format_number(self.pop_next_number_value())
 
     def pop_next_number_value(self):
-        raise NotImplementedError('Implement and return a `current_value` + 1')
+        if self.NUMBER_ALLOCATOR is not None:
+            return self.NUMBER_ALLOCATOR.allocate(self.numbering_prefix())
+        raise NotImplementedError('Implement and return a `current_value` + 1, or set NUMBER_ALLOCATOR')
 
     def save(self, *args, **kwargs):
         if self.NUMBER_AUTO and not self.number:
-            self.number = self.pop_next_number()
+            # Allocate and save together, a gapless allocator keeps its lock until commit
+            with transaction.atomic():
+                self.number = self.pop_next_number()
+                return super(AutoNumberModel, self).save(*args, **kwargs)
         return super(AutoNumberModel, self).save(*args, **kwargs)
 
 
@@ -76,28 +209,253 @@ class MPAwareModel(object):
 
     SLUG_FIELD = 'slug'
 
+    # Optional stored columns with the full name and slug paths, when set they
+    # are kept up to date on save and move and read instead of the ancestors.
+    NAME_PATH_FIELD = None
+    SLUG_PATH_FIELD = None
+
+    # Columns kept in the per process tree snapshot, see `get_snapshot()`
+    SNAPSHOT_FIELDS = None
+
     def get_name_path(self, separator=None):
+        if self.NAME_PATH_FIELD and separator in (None, self.NAME_SEPARATOR):
+            return getattr(self, self.NAME_PATH_FIELD)
         if not separator:
-            separator = self.SLUG_SEPARATOR
+            separator = self.NAME_SEPARATOR
         names = [node.verbose_name() for node in self.get_ancestors_and_self()]
         return separator.join(names)
 
     def get_slug_path(self, separator=None):
+        if self.SLUG_PATH_FIELD and separator in (None, self.SLUG_SEPARATOR):
+            return getattr(self, self.SLUG_PATH_FIELD)
         if not separator:
             separator = self.SLUG_SEPARATOR
         slugs = [getattr(node, self.SLUG_FIELD) for node in self.get_ancestors_and_self()]
         return separator.join(slugs)
 
+    @classmethod
+    def get_by_slug_path(cls, slug_path):
+        """Return the node matching the full slug path, using the indexed stored column."""
+        if not cls.SLUG_PATH_FIELD:
+            raise AttributeError('%s.SLUG_PATH_FIELD is not defined.' % cls.__name__)
+        return cls._default_manager.get(**{cls.SLUG_PATH_FIELD: slug_path})
+
+    @classmethod
+    def get_stored_path_fields(cls):
+        return [field for field in (cls.NAME_PATH_FIELD, cls.SLUG_PATH_FIELD) if field]
+
+    def build_stored_paths(self, parent_paths=None):
+        """Return a dict with the stored path values, built from the parent ones."""
+        if parent_paths is None:
+            parent = self.get_parent()
+            parent_paths = {}
+
+            if parent:
+                parent_paths = {field: getattr(parent, field) for field in self.get_stored_path_fields()}
+
+        paths = {}
+
+        if self.NAME_PATH_FIELD:
+            names = [parent_paths.get(self.NAME_PATH_FIELD), self.verbose_name()]
+            paths[self.NAME_PATH_FIELD] = self.NAME_SEPARATOR.join(name for name in names if name)
+
+        if self.SLUG_PATH_FIELD:
+            slugs = [parent_paths.get(self.SLUG_PATH_FIELD), getattr(self, self.SLUG_FIELD)]
+            paths[self.SLUG_PATH_FIELD] = self.SLUG_SEPARATOR.join(slug for slug in slugs if slug)
+
+        return paths
+
+    def update_descendant_paths(self, old_paths, new_paths):
+        """Replace the stored path prefix of all descendants, in a single UPDATE."""
+        updates = {}
+
+        for field in self.get_stored_path_fields():
+            old, new = old_paths.get(field) or '', new_paths[field]
+            if old and old != new:
+                updates[field] = Concat(Value(new), Substr(F(field), len(old) + 1), output_field=CharField())
+
+        if updates:
+            self.get_descendants().update(**updates)
+
+    def refresh_stored_paths(self):
+        fields = self.get_stored_path_fields()
+        new_paths = self.build_stored_paths()
+        old_paths = {}
+
+        if self.pk:
+            old_paths = type(self)._default_manager.filter(pk=self.pk).values(*fields).first() or {}
+            self.update_descendant_paths(old_paths, new_paths)
+
+        for field, value in new_paths.items():
+            setattr(self, field, value)
+
+    @classmethod
+    def get_snapshot_fields(cls):
+        if cls.SNAPSHOT_FIELDS:
+            return cls.SNAPSHOT_FIELDS
+        return ['pk', 'path', 'depth', cls.SLUG_FIELD] + cls.get_stored_path_fields()
+
+    @classmethod
+    def get_snapshot(cls):
+        """Return the per process snapshot of the whole tree, reloaded only when the tree changed.
+
+        Needs a cache shared by every process, see `TreeSnapshotCache`.
+        """
+        return tree_snapshots.get(cls)
+
+    @classmethod
+    def invalidate_snapshot(cls):
+        tree_snapshots.invalidate(cls)
+
+    def save(self, *args, **kwargs):
+        # Bump the snapshot version after the write, on_commit runs at once in autocommit
+        with transaction.atomic():
+            if self.get_stored_path_fields():
+                self.refresh_stored_paths()
+                update_fields = kwargs.get('update_fields')
+                if update_fields is not None:
+                    kwargs['update_fields'] = set(update_fields) | set(self.get_stored_path_fields())
+
+            result = super().save(*args, **kwargs)
+            self.invalidate_snapshot()
+
+        return result
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            result = super().delete(*args, **kwargs)
+            self.invalidate_snapshot()
+
+        return result
+
+    def move(self, target, pos=None):
+        manager = type(self)._default_manager
+        rollups = self.get_rollups()
+
+        with transaction.atomic():
+            if rollups:
+                # Take the subtree totals out of the old ancestors
+                targets = [rollup.target for rollup in rollups]
+                totals = manager.filter(pk=self.pk).values('path', *targets).get()
+                for rollup in rollups:
+                    rollup.apply_to_path(totals['path'], -totals[rollup.target], include_self=False)
+
+            super().move(target, pos)
+            self.invalidate_snapshot()
+
+            if not rollups and not self.get_stored_path_fields():
+                return
+
+            # The tree paths changed in the database, reload and rebuild from the new parent
+            node = manager.get(pk=self.pk)
+
+            for rollup in rollups:
+                rollup.apply_to_path(node.path, totals[rollup.target], include_self=False)
+
+            if self.get_stored_path_fields():
+                node.save(update_fields=node.get_stored_path_fields())
+
+    @classmethod
+    def get_rollups(cls):
+        return getattr(cls, '_rollups', [])
+
+    @classmethod
+    def recompute_rollups(cls, chunk_size=1000):
+        """Recompute every rollup column from scratch. Return the number of updated nodes.
+
+        Nodes are walked in reverse path order, so descendants are summed before
+        their ancestors keeping only the pending subtotals in memory.
+        """
+        rollups = cls.get_rollups()
+
+        if not rollups:
+            return 0
+
+        manager = cls._default_manager
+        targets = [rollup.target for rollup in rollups]
+        node_values = [rollup.get_node_values() for rollup in rollups]
+        subtotals = {}
+        changed = []
+
+        for pk, path, *current in manager.order_by('-path').values_list('pk', 'path', *targets).iterator():
+            pending = subtotals.pop(path, None) or [0] * len(rollups)
+            totals = [values.get(pk, 0) + pending[index] for index, values in enumerate(node_values)]
+
+            parent_path = path[:-cls.steplen]
+            if parent_path:
+                parent = subtotals.setdefault(parent_path, [0] * len(rollups))
+                for index, total in enumerate(totals):
+                    parent[index] += total
+
+            if totals != current:
+                changed.append((pk, dict(zip(targets, totals))))
+
+        for start in range(0, len(changed), chunk_size):
+            with transaction.atomic():
+                for pk, values in changed[start:start + chunk_size]:
+                    manager.filter(pk=pk).update(**values)
+
+        return len(changed)
+
+    @classmethod
+    def rebuild_stored_paths(cls, chunk_size=1000):
+        """Recompute the stored paths of the whole tree, walking it in path order by chunks.
+
+        Nodes ordered by path come parent first, so only the current branch is
+        kept in memory. Return the number of updated nodes.
+        """
+        fields = cls.get_stored_path_fields()
+        manager = cls._default_manager
+        branch = []  # Stored paths of the current node ancestors, indexed by depth
+        last_path = ''
+        updated = 0
+
+        while True:
+            chunk = list(manager.filter(path__gt=last_path).order_by('path')[:chunk_size])
+
+            if not chunk:
+                break
+
+            with transaction.atomic():
+                for node in chunk:
+                    del branch[node.depth - 1:]
+                    paths = node.build_stored_paths(branch[-1] if branch else {})
+                    branch.append(paths)
+
+                    if any(getattr(node, field) != paths[field] for field in fields):
+                        manager.filter(pk=node.pk).update(**paths)
+                        updated += 1
+
+            last_path = chunk[-1].path
+
+        return updated
+
+    def get_tree_node(self):
+        """Return the in-memory tree node, when the instance was loaded with `load_tree()`."""
+        return getattr(self, '_tree_node', None)
+
     def has_children(self) -> bool:
         """Check the category has one children or more."""
-        return self.get_children_count() > 0
+        # numchild is stored by treebeard, right even when load_tree() got a filtered queryset
+        return self.numchild > 0
 
     def get_ancestors_and_self(self) -> list:
         """Return a list of all ancestors including the category."""
+        node = self.get_tree_node()
+        if node is not None:
+            ancestors = [ancestor.obj for ancestor in node.iter_ancestors()]
+            if len(ancestors) == self.depth - 1:
+                return chain(reversed(ancestors), [self])
         return chain(self.get_ancestors(), [self])
 
     def get_descendants_and_self(self) -> list:
         """Return a list of all descendants including the category."""
+        node = self.get_tree_node()
+        if node is not None:
+            nodes = [node] + list(node.iter_descendants())
+            # A filtered load_tree() can miss descendants, trust it only when numchild agrees
+            if all(len(item.children) == item.obj.numchild for item in nodes):
+                return (item.obj for item in nodes)
         return chain([self], self.get_descendants())
 
     def filter(self, *args, **kwargs):
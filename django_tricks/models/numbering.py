@@ -0,0 +1,148 @@
+import os
+import re
+import threading
+
+from django.db import IntegrityError, connections, router, transaction
+from django.db.models import F
+
+
+class BaseNumberAllocator:
+    """Return the next number of a numbering prefix, see `AutoNumberModel.NUMBER_ALLOCATOR`."""
+
+    def allocate(self, prefix):
+        raise NotImplementedError()
+
+
+class SequenceAllocator(BaseNumberAllocator):
+    """Allocate numbers from a PostgreSQL sequence per prefix.
+
+    Never blocks concurrent writers, numbers taken by rolled back transactions
+    are lost so the numbering can have gaps.
+    """
+
+    def __init__(self, using='default', sequence_prefix='django_tricks_number_'):
+        self.using = using
+        self.sequence_prefix = sequence_prefix
+        self.created = set()
+
+    def get_sequence_name(self, prefix):
+        name = re.sub(r'[^a-z0-9_]+', '_', prefix.lower()).strip('_')
+        return ('%s%s' % (self.sequence_prefix, name))[:63]
+
+    def allocate(self, prefix):
+        name = self.get_sequence_name(prefix)
+
+        with connections[self.using].cursor() as cursor:
+            if name not in self.created:
+                try:
+                    with transaction.atomic(using=self.using):
+                        cursor.execute('CREATE SEQUENCE IF NOT EXISTS %s' % name)
+                except IntegrityError:
+                    # Created by a concurrent transaction meanwhile
+                    pass
+
+                # The CREATE is undone if the caller's transaction rolls back
+                transaction.on_commit(lambda: self.created.add(name), using=self.using)
+
+            cursor.execute('SELECT nextval(%s)', [name])
+            return cursor.fetchone()[0]
+
+
+class CounterAllocator(BaseNumberAllocator):
+    """Allocate numbers from a counter table, a concrete `NumberCounterModel`.
+
+    With `gapless=True` the counter row is locked until the transaction saving
+    the numbered object commits, so numbers are strictly consecutive but
+    writers of the same prefix are serialized. Otherwise blocks of
+    `block_size` numbers are reserved with a single UPDATE and handed out from
+    memory by each process (hi/lo), numbers of unused blocks are lost.
+
+    Blocks are reserved and committed on a connection of their own, `reserve_using`
+    (default: a private alias of the counter model database), so neither the row
+    lock nor a rollback of the caller's transaction affect them. On SQLite, which
+    has a single writer, the block is reserved in the caller's transaction and
+    only cached once that commits.
+    """
+
+    def __init__(self, counter_model, gapless=True, block_size=100, reserve_using=None):
+        self.counter_model = counter_model
+        self.gapless = gapless
+        self.block_size = block_size
+        self.reserve_using = reserve_using
+        # Reentrant, on_commit runs keep_block at once outside transactions
+        self.lock = threading.RLock()
+        self.blocks = {}
+        self.pid = os.getpid()
+
+    def allocate(self, prefix):
+        if self.gapless:
+            return self.allocate_locked(prefix)
+        return self.allocate_from_block(prefix)
+
+    def increment(self, prefix, step, using=None):
+        """Add step to the prefix counter and return its new value, creating the counter when missing."""
+        manager = self.counter_model._default_manager.db_manager(using)
+        counters = manager.filter(prefix=prefix)
+
+        with transaction.atomic(using=manager.db):
+            # Write first, so the row (or SQLite database) lock is taken by the first statement
+            if not counters.update(value=F('value') + step):
+                manager.get_or_create(prefix=prefix, defaults={'value': 0})
+                counters.update(value=F('value') + step)
+
+            return counters.values_list('value', flat=True).get()
+
+    def allocate_locked(self, prefix):
+        return self.increment(prefix, 1)
+
+    def get_reserve_using(self):
+        """Return the alias blocks are reserved on, None to use the caller's transaction."""
+        if self.reserve_using:
+            return self.reserve_using
+
+        using = router.db_for_write(self.counter_model)
+
+        if connections[using].vendor == 'sqlite':
+            # A second connection would wait for the caller's write lock
+            return None
+
+        alias = '%s__numbering' % using
+        # Same settings, so a connection of its own per thread
+        connections.databases.setdefault(alias, connections.databases[using])
+        return alias
+
+    def reserve_block(self, prefix, using=None):
+        high = self.increment(prefix, self.block_size, using)
+        return [high - self.block_size + 1, high]
+
+    def keep_block(self, prefix, block):
+        with self.lock:
+            current = self.blocks.get(prefix)
+
+            if current is None or current[0] > current[1]:
+                self.blocks[prefix] = block
+
+    def allocate_from_block(self, prefix):
+        with self.lock:
+            if self.pid != os.getpid():
+                # Forked, the blocks reserved by the parent process are not ours
+                self.blocks, self.pid = {}, os.getpid()
+
+            block = self.blocks.get(prefix)
+
+            if block is None or block[0] > block[1]:
+                using = self.get_reserve_using()
+                block = self.reserve_block(prefix, using)
+
+                if using is None:
+                    # Undone if the caller's transaction rolls back, keep the rest of it once committed
+                    value = block[0]
+                    block[0] += 1
+                    transaction.on_commit(lambda: self.keep_block(prefix, block))
+                    return value
+
+                self.blocks[prefix] = block
+
+            value = block[0]
+            block[0] += 1
+            return value
@@ -0,0 +1,338 @@
+import sys
+import threading
+import time
+from collections import deque, namedtuple
+
+from django.core.cache import cache
+from django.db import transaction
+
+
+class TreeNode:
+    """A node of an in-memory materialized path tree, wraps the model instance."""
+
+    __slots__ = ('obj', 'parent', 'children')
+
+    def __init__(self, obj, parent=None):
+        self.obj = obj
+        self.parent = parent
+        self.children = []
+
+    def __repr__(self):
+        return '<TreeNode %s>' % self.obj.path
+
+    def iter_ancestors(self):
+        node = self.parent
+        while node is not None:
+            yield node
+            node = node.parent
+
+    def iter_descendants(self):
+        stack = list(reversed(self.children))
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(reversed(node.children))
+
+
+class Tree:
+    """A tree built from a list of materialized path nodes ordered by path.
+
+    Parent and child links come from the path prefixes, so the tree is built
+    from a single query and answers children, ancestors and descendants
+    without touching the database again. Every loaded instance gets a
+    `_tree_node` reference, used by `MPAwareModel.get_ancestors_and_self` and
+    `get_descendants_and_self`.
+
+    example:
+
+        >>> tree = Category.objects.load_tree()
+        >>> [node.name for node in tree.get_descendants(category)]
+
+    """
+
+    def __init__(self, objects, steplen, attach=True):
+        self.steplen = steplen
+        self.nodes = {}
+        self.roots = []
+
+        for obj in objects:
+            parent = self.nodes.get(obj.path[:-steplen])
+            node = TreeNode(obj, parent)
+
+            if parent is None:
+                self.roots.append(node)
+            else:
+                parent.children.append(node)
+
+            self.nodes[obj.path] = node
+
+            if attach:
+                obj._tree_node = node
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __iter__(self):
+        for root in self.roots:
+            yield root.obj
+            for node in root.iter_descendants():
+                yield node.obj
+
+    def __contains__(self, obj):
+        return obj.path in self.nodes
+
+    def get_node(self, obj):
+        return self.nodes[obj.path if hasattr(obj, 'path') else obj]
+
+    def get(self, path):
+        return self.nodes[path].obj
+
+    def get_roots(self):
+        return [node.obj for node in self.roots]
+
+    def get_parent(self, obj):
+        parent = self.get_node(obj).parent
+        return parent.obj if parent else None
+
+    def get_children(self, obj):
+        return [node.obj for node in self.get_node(obj).children]
+
+    def has_children(self, obj):
+        return bool(self.get_node(obj).children)
+
+    def get_ancestors(self, obj):
+        """Return the loaded ancestors, from the top of the tree to the parent."""
+        return [node.obj for node in reversed(list(self.get_node(obj).iter_ancestors()))]
+
+    def get_descendants(self, obj):
+        """Return the descendants in path order."""
+        return [node.obj for node in self.get_node(obj).iter_descendants()]
+
+
+class LoadingNode:
+    __slots__ = ('obj', 'path', 'depth', 'paths', 'children')
+
+    def __init__(self, obj, path, depth, paths, children=0):
+        self.obj = obj
+        self.path = path
+        self.depth = depth
+        self.paths = paths
+        self.children = children
+
+
+class TreeLoader:
+    """Insert a large tree with `bulk_create`, computing path, depth, numchild
+    and the stored name/slug paths in memory.
+
+    Rows are `(key, parent_key, data)` tuples listed level by level, parents
+    first, with `parent_key=None` for the top nodes. A level is written once
+    the next one is read, so only two levels are kept in memory. Siblings are
+    numbered in the order given, sort them first when the model uses
+    `node_order_by`.
+    """
+
+    def __init__(self, model, parent=None, batch_size=5000):
+        self.model = model
+        self.parent = parent
+        self.batch_size = batch_size
+        self.inserted = 0
+
+    def iter_nested(self, nodes):
+        """Walk treebeard's `load_bulk` format, `{'data': {...}, 'children': [...]}`, breadth first."""
+        queue = deque((node, None) for node in nodes)
+
+        while queue:
+            node, parent_key = queue.popleft()
+            yield id(node), parent_key, node.get('data', {})
+            queue.extend((child, id(node)) for child in node.get('children', ()))
+
+    def get_top(self):
+        model = self.model
+
+        if self.parent is None:
+            last = model.get_last_root_node()
+            top = LoadingNode(None, '', 0, {})
+        else:
+            last = self.parent.get_last_child()
+            paths = {field: getattr(self.parent, field) for field in model.get_stored_path_fields()}
+            top = LoadingNode(self.parent, self.parent.path, self.parent.depth, paths)
+
+        if last is not None:
+            top.children = model._str2int(last.path[-model.steplen:])
+
+        return top
+
+    def make_node(self, owner, data):
+        model = self.model
+        owner.children += 1
+        depth = owner.depth + 1
+        path = model._get_path(owner.path, depth, owner.children)
+
+        if len(path) != depth * model.steplen:
+            raise ValueError('Path overflow adding child %s to "%s".' % (owner.children, owner.path))
+
+        obj = model(path=path, depth=depth, numchild=0, **data)
+        paths = obj.build_stored_paths(owner.paths) if model.get_stored_path_fields() else {}
+
+        for field, value in paths.items():
+            setattr(obj, field, value)
+
+        return LoadingNode(obj, path, depth, paths)
+
+    def flush(self, level):
+        objs = []
+
+        for node in level.values():
+            node.obj.numchild = node.children
+            objs.append(node.obj)
+
+        self.model._default_manager.bulk_create(objs, batch_size=self.batch_size)
+        self.inserted += len(objs)
+
+    def load(self, rows):
+        top = self.get_top()
+        start = top.children
+        parents, current = {}, {}
+
+        for key, parent_key, data in rows:
+            if parent_key is None:
+                if parents:
+                    raise ValueError('Top nodes must be listed before their descendants.')
+                owner = top
+            elif parent_key in current:
+                # First node of the next level, the parents level is complete
+                self.flush(parents)
+                parents, current = current, {}
+                owner = parents[parent_key]
+            elif parent_key in parents:
+                owner = parents[parent_key]
+            else:
+                raise ValueError('Parent %r not found, nodes must be listed level by level, '
+                                 'parents first.' % (parent_key,))
+
+            current[key] = self.make_node(owner, data)
+
+        self.flush(parents)
+        self.flush(current)
+
+        if self.parent is not None and top.children > start:
+            type(self.parent)._default_manager.filter(pk=self.parent.pk).update(
+                numchild=self.parent.numchild + top.children - start)
+
+        return self.inserted
+
+
+class TreeSnapshot:
+    """A compact, read only copy of a whole tree, made of namedtuple rows."""
+
+    def __init__(self, model, version, fields):
+        self.model = model
+        self.version = version
+        self.fields = tuple(fields)
+
+        Row = namedtuple('%sRow' % model.__name__, [field.replace('__', '_') for field in self.fields])
+        rows = (Row(*values) for values in model._default_manager.order_by('path').values_list(*self.fields))
+        self.tree = Tree(rows, steplen=model.steplen, attach=False)
+
+    def __len__(self):
+        return len(self.tree)
+
+    def get(self, path):
+        return self.tree.get(path)
+
+    def get_children(self, path):
+        return self.tree.get_children(path)
+
+    def get_ancestors(self, path):
+        return self.tree.get_ancestors(path)
+
+    def get_descendants(self, path=None):
+        if path is None:
+            return list(self.tree)
+        return self.tree.get_descendants(path)
+
+    def filter(self, path=None, **kwargs):
+        """Return the rows under path (or in the whole tree) with matching attribute values."""
+        return [row for row in self.get_descendants(path)
+                if all(getattr(row, name) == value for name, value in kwargs.items())]
+
+    def memory_usage(self):
+        """Return the approximate number of bytes used by the snapshot."""
+        size = sys.getsizeof(self.tree.nodes) + sys.getsizeof(self.tree.roots)
+
+        for node in self.tree.nodes.values():
+            size += sys.getsizeof(node) + sys.getsizeof(node.children) + sys.getsizeof(node.obj)
+            size += sum(sys.getsizeof(value) for value in node.obj)
+
+        return size
+
+
+class TreeSnapshotCache:
+    """Keep a per process snapshot of each tree, invalidated by a version in the shared cache.
+
+    Reading a tree costs a single cache get while the version didn't change.
+    Saving, moving or deleting a node bumps the version once the transaction
+    commits, so every process reloads its snapshot on next use.
+
+    The default cache must be shared by every process (memcached, redis, the
+    database cache): with LocMemCache a process never sees the versions bumped
+    by the others and keeps serving its stale snapshot. With a cache that
+    keeps nothing, like DummyCache, the tree is reloaded on every read.
+    """
+
+    key_prefix = 'django_tricks:tree_version:'
+
+    def __init__(self):
+        self.snapshots = {}
+        self.lock = threading.Lock()
+
+    def get_version_key(self, model):
+        return '%s%s' % (self.key_prefix, model._meta.label_lower)
+
+    def get_version(self, model):
+        key = self.get_version_key(model)
+        version = cache.get(key)
+
+        if version is None:
+            cache.add(key, int(time.time() * 1000), None)
+            version = cache.get(key)
+
+        return version
+
+    def bump(self, model):
+        key = self.get_version_key(model)
+
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, int(time.time() * 1000), None)
+
+    def invalidate(self, model):
+        transaction.on_commit(lambda: self.bump(model))
+
+    def get(self, model):
+        version = self.get_version(model)
+
+        if version is None:
+            # The cache didn't keep the version, a kept snapshot could never be invalidated
+            return TreeSnapshot(model, None, model.get_snapshot_fields())
+
+        snapshot = self.snapshots.get(model)
+
+        if snapshot is None or snapshot.version != version:
+            with self.lock:
+                snapshot = self.snapshots.get(model)
+
+                if snapshot is None or snapshot.version != version:
+                    snapshot = TreeSnapshot(model, version, model.get_snapshot_fields())
+                    self.snapshots[model] = snapshot
+
+        return snapshot
+
+    def memory_usage(self):
+        """Return the approximate bytes used by every loaded snapshot, by model label."""
+        return {model._meta.label: snapshot.memory_usage()
+                for model, snapshot in list(self.snapshots.items())}
+
+
+tree_snapshots = TreeSnapshotCache()
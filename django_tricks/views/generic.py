@@ -1,16 +1,61 @@
+import calendar
+import csv
+import hashlib
+import json
+import warnings
+
+from django.conf import settings
 from django.core.exceptions import ImproperlyConfigured
-from django.http import Http404
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.db.models import Count, Max
+from django.http import Http404, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
 from django.utils.translation import gettext_lazy as _
 from django.views.generic.base import TemplateResponseMixin, View
 from django.views.generic.detail import SingleObjectMixin
 from django.views.generic.list import MultipleObjectMixin
 
+from .pagination import CountingPaginator, InvalidCursor, KeysetPage, KeysetPaginator
+
+
+class QueryBudgetWarning(RuntimeWarning):
+    pass
+
+
+class Echo:
+    """A file-like object that returns what is written, to stream csv.writer rows."""
+
+    def write(self, value):
+        return value
+
 
 class MasterDetailMixin(MultipleObjectMixin, SingleObjectMixin):
     belongs_model = None
     belongs_queryset = None
     related_name = None
 
+    # Applied to the master and detail querysets to avoid N+1 queries
+    belongs_only = None
+    detail_select_related = None
+    detail_prefetch_related = None
+    detail_only = None
+
+    # Set to 'keyset' to seek by `keyset_ordering` instead of using OFFSET/LIMIT
+    pagination_mode = 'offset'
+    keyset_ordering = None
+    keyset_paginator_class = KeysetPaginator
+    cursor_kwarg = 'cursor'
+
+    # How to count the detail relation for OFFSET/LIMIT pagination, one of
+    # 'exact', 'capped' or 'estimate'. Counts are cached per master object
+    # when `count_cache_timeout` is set.
+    paginator_class = CountingPaginator
+    count_mode = 'exact'
+    count_cap = 10000
+    count_cache_timeout = None
+
     def get_object(self, queryset=None):
         queryset = self.get_belongs_queryset()
         return super(MultipleObjectMixin, self).get_object(queryset=queryset)
@@ -31,6 +76,9 @@ class MasterDetailMixin(MultipleObjectMixin, SingleObjectMixin):
                     "%(cls)s.model, %(cls)s.belongs_queryset, or override "
                     "%(cls)s.get_belongs_queryset()." % {'cls': self.__class__.__name__})
 
+        if self.belongs_only:
+            queryset = queryset.only(*self.belongs_only)
+
         return queryset.all()
 
     def get_queryset(self, belongs_object=None):
@@ -38,16 +86,228 @@ class MasterDetailMixin(MultipleObjectMixin, SingleObjectMixin):
         if related_name not in self.belongs_model._meta.fields_map:
             raise ImproperlyConfigured('Wrong related reference')
 
-        return getattr(belongs_object or self.get_object(), related_name).all()
+        queryset = getattr(belongs_object or self.get_object(), related_name).all()
+        return self.optimize_queryset(queryset)
+
+    def optimize_queryset(self, queryset):
+        """Apply the declared select_related, prefetch_related and only to the detail queryset."""
+        if self.detail_select_related:
+            queryset = queryset.select_related(*self.detail_select_related)
+
+        if self.detail_prefetch_related:
+            queryset = queryset.prefetch_related(*self.detail_prefetch_related)
+
+        if self.detail_only:
+            queryset = queryset.only(*self.detail_only)
+
+        return queryset
+
+    def get_count_cache_key(self):
+        opts = self.object._meta
+        return 'django_tricks:detail_count:%s.%s:%s:%s:%s' % (
+            opts.app_label, opts.model_name, self.object.pk, self.get_related_name(), self.count_mode)
+
+    def get_paginator(self, queryset, per_page, orphans=0, allow_empty_first_page=True, **kwargs):
+        if issubclass(self.paginator_class, CountingPaginator):
+            kwargs.setdefault('count_mode', self.count_mode)
+            kwargs.setdefault('count_cap', self.count_cap)
+
+            if self.count_cache_timeout is not None and getattr(self, 'object', None) is not None:
+                kwargs.setdefault('cache_key', self.get_count_cache_key())
+                kwargs.setdefault('cache_timeout', self.count_cache_timeout)
+
+        return super().get_paginator(
+            queryset, per_page, orphans=orphans, allow_empty_first_page=allow_empty_first_page, **kwargs)
+
+    def get_keyset_ordering(self):
+        return self.keyset_ordering or self.get_ordering() or ('pk',)
+
+    def get_cursor(self):
+        return self.kwargs.get(self.cursor_kwarg) or self.request.GET.get(self.cursor_kwarg) or None
+
+    def paginate_queryset(self, queryset, page_size):
+        if self.pagination_mode != 'keyset':
+            return super().paginate_queryset(queryset, page_size)
+
+        paginator = self.keyset_paginator_class(queryset, page_size, ordering=self.get_keyset_ordering())
+
+        try:
+            page = paginator.page(self.get_cursor())
+        except InvalidCursor as err:
+            raise Http404(_('Invalid cursor: %(message)s') % {'message': str(err)})
+
+        return paginator, page, page.object_list, page.has_other_pages()
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        page = context.get('page_obj')
+
+        if isinstance(page, KeysetPage):
+            context['next_cursor'] = page.next_cursor
+            context['previous_cursor'] = page.previous_cursor
+
+        return context
 
 
 class MasterDetailView(TemplateResponseMixin, MasterDetailMixin, View):
     template_name_suffix = '_list'
 
+    # Warn when DEBUG is on and a request runs more queries than this
+    query_budget = None
+
+    # Answer with 304 Not Modified, before building the context, when the
+    # master and its details didn't change. Uses the given timestamp fields.
+    conditional_get = False
+    belongs_modified_field = None
+    detail_modified_field = None
+
+    # Stream the detail rows as CSV or JSON Lines instead of rendering the
+    # template, when `?format=csv` is requested or `export_format` is set.
+    export_fields = None
+    export_format = None
+    export_format_kwarg = 'format'
+    export_content_types = {
+        'csv': 'text/csv',
+        'jsonl': 'application/x-ndjson',
+    }
+
+    def dispatch(self, request, *args, **kwargs):
+        if not settings.DEBUG or self.query_budget is None:
+            return super().dispatch(request, *args, **kwargs)
+
+        from django.test.utils import CaptureQueriesContext
+
+        # The detail rows are read from the database of their master
+        using = self.get_belongs_queryset().db
+
+        with CaptureQueriesContext(connections[using]) as queries:
+            response = super().dispatch(request, *args, **kwargs)
+
+            # Template responses are lazy, render them while queries are captured
+            if hasattr(response, 'render') and not response.is_rendered:
+                response.render()
+
+        if len(queries) > self.query_budget:
+            warnings.warn('%s ran %s queries, over its budget of %s. Check detail_select_related '
+                          'and detail_prefetch_related.' % (self.__class__.__name__, len(queries),
+                                                            self.query_budget),
+                          QueryBudgetWarning)
+
+        return response
+
+    def get_validator_queryset(self):
+        """Return the master modified timestamp, the latest detail modified timestamp and the
+        detail count for the requested master, computed in a single query."""
+        queryset = self.get_belongs_queryset()
+        pk = self.kwargs.get(self.pk_url_kwarg)
+        slug = self.kwargs.get(self.slug_url_kwarg)
+
+        if pk is not None:
+            queryset = queryset.filter(pk=pk)
+
+        if slug is not None and (pk is None or self.query_pk_and_slug):
+            queryset = queryset.filter(**{self.get_slug_field(): slug})
+
+        relation = self.belongs_model._meta.fields_map[self.get_related_name()]
+        fields = [self.belongs_modified_field] if self.belongs_modified_field else []
+        aggregates = {'detail_count': Count(relation.name)}
+
+        if self.detail_modified_field:
+            aggregates['detail_modified'] = Max('%s__%s' % (relation.name, self.detail_modified_field))
+
+        return queryset.annotate(**aggregates).values(*fields, *aggregates)
+
+    def get_validators(self):
+        """Return an (etag, last_modified) tuple, both None when the master doesn't exist."""
+        row = self.get_validator_queryset().first()
+
+        if row is None:
+            return None, None
+
+        timestamps = [row.get(self.belongs_modified_field), row.get('detail_modified')]
+        timestamps = [timestamp for timestamp in timestamps if timestamp is not None]
+        last_modified = calendar.timegm(max(timestamps).utctimetuple()) if timestamps else None
+
+        validator = ':'.join(str(value) for key, value in sorted(row.items()))
+        etag = hashlib.md5(validator.encode()).hexdigest()
+
+        return etag, last_modified
+
     def get(self, request, *args, **kwargs):
+        if not self.conditional_get:
+            return self.render_detail(request, *args, **kwargs)
+
+        etag, last_modified = self.get_validators()
+
+        # Compared against the quoted values of If-None-Match and If-Match
+        etag = quote_etag(etag) if etag else None
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+
+        if response is None:
+            response = self.render_detail(request, *args, **kwargs)
+
+            if etag and not response.has_header('ETag'):
+                response['ETag'] = etag
+
+            if last_modified and not response.has_header('Last-Modified'):
+                response['Last-Modified'] = http_date(last_modified)
+
+        return response
+
+    def get_export_format(self):
+        kwarg = self.export_format_kwarg
+        export_format = self.export_format or self.kwargs.get(kwarg) or self.request.GET.get(kwarg)
+
+        if not export_format or not self.export_fields:
+            return None
+
+        if export_format not in self.export_content_types:
+            raise Http404(_('Unknown export format: %(format)s') % {'format': export_format})
+
+        return export_format
+
+    def get_export_fields(self):
+        return list(self.export_fields)
+
+    def get_export_filename(self, export_format):
+        opts = self.object._meta
+        return '%s-%s-%s.%s' % (opts.model_name, self.object.pk, self.get_related_name(), export_format)
+
+    def iter_export_rows(self, queryset):
+        # iterator() skips the queryset cache, PostgreSQL uses a server-side cursor
+        return queryset.values_list(*self.get_export_fields()).iterator()
+
+    def iter_csv(self, rows):
+        writer = csv.writer(Echo())
+        yield writer.writerow(self.get_export_fields())
+
+        for row in rows:
+            yield writer.writerow(row)
+
+    def iter_jsonl(self, rows):
+        fields = self.get_export_fields()
+
+        for row in rows:
+            yield json.dumps(dict(zip(fields, row)), cls=DjangoJSONEncoder) + '\n'
+
+    def render_export(self, export_format):
+        rows = self.iter_export_rows(self.object_list)
+        content = getattr(self, 'iter_%s' % export_format)(rows)
+
+        response = StreamingHttpResponse(content, content_type=self.export_content_types[export_format])
+        filename = self.get_export_filename(export_format)
+        response['Content-Disposition'] = 'attachment; filename="%s"' % filename
+        return response
+
+    def render_detail(self, request, *args, **kwargs):
         self.object = self.get_object()
         self.object_list = self.get_queryset(self.object)
 
+        export_format = self.get_export_format()
+
+        if export_format:
+            return self.render_export(export_format)
+
         allow_empty = self.get_allow_empty()
 
         if not allow_empty:
@@ -74,3 +334,9 @@ class MasterDetailView(TemplateResponseMixin, MasterDetailMixin, View):
             names.append("%s/%s%s.html" % (opts.app_label, opts.model_name, self.template_name_suffix))
 
         return names
+
+
+class MasterDetailExportView(MasterDetailView):
+    """Always stream the detail rows, as CSV unless `export_format` says otherwise."""
+
+    export_format = 'csv'
@@ -0,0 +1,273 @@
+import datetime
+import json
+import operator
+from functools import reduce
+
+from django.core import signing
+from django.core.cache import cache
+from django.core.paginator import InvalidPage, Paginator
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.db.models import Q
+from django.utils.formats import number_format
+from django.utils.functional import cached_property
+
+
+class InvalidCursor(InvalidPage):
+    pass
+
+
+class CursorJSONEncoder(DjangoJSONEncoder):
+    """DjangoJSONEncoder keeping the microseconds, it truncates times to milliseconds."""
+
+    def default(self, o):
+        if isinstance(o, (datetime.datetime, datetime.time)):
+            return o.isoformat()
+        return super().default(o)
+
+
+class CursorSerializer:
+    """Serialize cursor payloads to JSON, supporting dates, decimals and uuids."""
+
+    def dumps(self, obj):
+        return json.dumps(obj, cls=CursorJSONEncoder, separators=(',', ':')).encode('latin-1')
+
+    def loads(self, data):
+        return json.loads(data.decode('latin-1'))
+
+
+class KeysetPage:
+    """A page of results fetched by seeking after (or before) a cursor.
+
+    Mimics the parts of `django.core.paginator.Page` that make sense without
+    page numbers or a total count.
+    """
+
+    def __init__(self, object_list, paginator, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __repr__(self):
+        return '<KeysetPage of %s objects>' % len(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_previous() or self.has_next()
+
+
+class KeysetPaginator:
+    """Paginate a queryset with a `WHERE (ordering) > (cursor)` seek instead of OFFSET.
+
+    Every page costs the same no matter how deep it is and no `COUNT(*)` is
+    issued. The ordering must be made of concrete, non nullable fields of the
+    queryset model and must be unique, `pk` is appended when missing to
+    guarantee it.
+
+    example:
+
+        >>> paginator = KeysetPaginator(Comment.objects.all(), 20, ordering=['-created'])
+        >>> page = paginator.page()
+        >>> page = paginator.page(page.next_cursor)
+
+    """
+
+    NEXT = 'n'
+    PREVIOUS = 'p'
+
+    cursor_salt = 'django_tricks.views.pagination.KeysetPaginator'
+
+    def __init__(self, object_list, per_page, ordering=('pk',)):
+        self.object_list = object_list
+        self.per_page = int(per_page)
+        self.ordering = self.parse_ordering(ordering)
+
+    def parse_ordering(self, ordering):
+        opts = self.object_list.model._meta
+        parsed = []
+
+        for name in ordering:
+            descending = name.startswith('-')
+            name = name.lstrip('-')
+            field = opts.pk if name == 'pk' else opts.get_field(name)
+            parsed.append((name, field.attname, descending))
+
+        if not any(attname == opts.pk.attname for name, attname, descending in parsed):
+            parsed.append(('pk', opts.pk.attname, parsed[-1][2] if parsed else False))
+
+        return tuple(parsed)
+
+    def get_order_by(self, reverse=False):
+        return ['%s%s' % ('-' if descending != reverse else '', name)
+                for name, attname, descending in self.ordering]
+
+    def get_seek_filter(self, values, reverse=False):
+        """Expand the row comparison `(a, b) > (x, y)` to `a > x OR (a = x AND b > y)`."""
+        clauses = []
+
+        for index, (name, attname, descending) in enumerate(self.ordering):
+            lookup = 'lt' if descending != reverse else 'gt'
+            clause = Q(**{'%s__%s' % (name, lookup): values[index]})
+
+            for (prev_name, _, _), value in zip(self.ordering[:index], values):
+                clause &= Q(**{prev_name: value})
+
+            clauses.append(clause)
+
+        return reduce(operator.or_, clauses)
+
+    def encode_cursor(self, direction, obj):
+        values = [getattr(obj, attname) for name, attname, descending in self.ordering]
+        return signing.dumps([direction, values], salt=self.cursor_salt, serializer=CursorSerializer)
+
+    def decode_cursor(self, cursor):
+        try:
+            direction, values = signing.loads(cursor, salt=self.cursor_salt, serializer=CursorSerializer)
+        except (signing.BadSignature, TypeError, ValueError):
+            raise InvalidCursor('Invalid cursor.')
+
+        if direction not in (self.NEXT, self.PREVIOUS) or len(values) != len(self.ordering):
+            raise InvalidCursor('Invalid cursor.')
+
+        return direction, values
+
+    def page(self, cursor=None):
+        direction, values = self.decode_cursor(cursor) if cursor else (self.NEXT, None)
+        reverse = direction == self.PREVIOUS
+
+        queryset = self.object_list.order_by(*self.get_order_by(reverse))
+
+        if values is not None:
+            queryset = queryset.filter(self.get_seek_filter(values, reverse))
+
+        # Fetch one extra row to know if there is something beyond this page
+        rows = list(queryset[:self.per_page + 1])
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+
+        if reverse:
+            rows.reverse()
+            has_next, has_previous = True, has_more
+        else:
+            has_next, has_previous = has_more, values is not None
+
+        next_cursor = previous_cursor = None
+
+        if rows and has_next:
+            next_cursor = self.encode_cursor(self.NEXT, rows[-1])
+
+        if rows and has_previous:
+            previous_cursor = self.encode_cursor(self.PREVIOUS, rows[0])
+
+        return KeysetPage(rows, self, next_cursor=next_cursor, previous_cursor=previous_cursor)
+
+
+class CountingPaginator(Paginator):
+    """A Paginator that can avoid an exact `COUNT(*)` over huge querysets.
+
+    count_mode:
+
+        'exact'     Regular `COUNT(*)`, same as Django's Paginator.
+        'capped'    Count at most `count_cap` + 1 rows, `count_display` renders
+                    as "10,000+" and pages past the cap are not reachable.
+        'estimate'  Use the PostgreSQL planner estimate, falling back to an exact
+                    count when the estimate is below `count_cap` or the database
+                    is not PostgreSQL.
+
+    When `cache_key` is given the count is kept in the default cache for
+    `cache_timeout` seconds.
+    """
+
+    COUNT_MODES = ('exact', 'capped', 'estimate')
+
+    def __init__(self, object_list, per_page, orphans=0, allow_empty_first_page=True,
+                 count_mode='exact', count_cap=10000, cache_key=None, cache_timeout=None):
+        if count_mode not in self.COUNT_MODES:
+            raise ValueError('Unknown count mode: %s' % count_mode)
+
+        self.count_mode = count_mode
+        self.count_cap = count_cap
+        self.cache_key = cache_key
+        self.cache_timeout = cache_timeout
+
+        super().__init__(object_list, per_page, orphans=orphans,
+                         allow_empty_first_page=allow_empty_first_page)
+
+    @cached_property
+    def _count(self):
+        """Return a (count, is_exact) tuple."""
+        if self.cache_key:
+            result = cache.get(self.cache_key)
+
+            if result is None:
+                result = self.compute_count()
+                cache.set(self.cache_key, result, self.cache_timeout)
+
+            return tuple(result)
+
+        return self.compute_count()
+
+    @property
+    def count(self):
+        return self._count[0]
+
+    @property
+    def count_is_exact(self):
+        return self._count[1]
+
+    @property
+    def count_display(self):
+        display = number_format(self.count, force_grouping=True)
+        return display if self.count_is_exact else '%s+' % display
+
+    def compute_count(self):
+        queryset = self.object_list
+
+        if not hasattr(queryset, 'query'):
+            return len(queryset), True
+
+        if self.count_mode == 'capped':
+            count = queryset.order_by()[:self.count_cap + 1].count()
+            if count > self.count_cap:
+                return self.count_cap, False
+            return count, True
+
+        if self.count_mode == 'estimate':
+            estimate = self.estimate_count(queryset)
+            if estimate is not None and estimate >= self.count_cap:
+                return estimate, False
+
+        return queryset.count(), True
+
+    def estimate_count(self, queryset):
+        """Return the number of rows the PostgreSQL planner expects, or None."""
+        connection = connections[queryset.db]
+
+        if connection.vendor != 'postgresql':
+            return None
+
+        sql, params = queryset.order_by().query.sql_with_params()
+
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN (FORMAT JSON) %s' % sql, params)
+            plan = cursor.fetchone()[0]
+
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+
+        return int(plan[0]['Plan']['Plan Rows'])
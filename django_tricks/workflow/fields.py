@@ -1,11 +1,16 @@
 from collections import namedtuple, OrderedDict
 from functools import wraps
 from itertools import chain
+from types import MappingProxyType
 
-from django.db.models import CharField
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections, transaction
+from django.db.models import CharField, QuerySet
 from django.dispatch import Signal
 from django.utils.functional import curry
 
+from django_tricks.models.fields import CachedChoicesSelect
+
 
 class DefaultDict(OrderedDict):
     def __init__(self, default_factory, *args, **kwargs):
@@ -21,6 +26,7 @@ class DefaultDict(OrderedDict):
 class Workflow(CharField):
     nodes = None
     pre_transition = Signal(providing_args=["instance"])
+    bulk_transition = Signal(providing_args=["field", "to_state", "pks"])
 
     State = namedtuple('State', ['state', 'label'])
     Starts = namedtuple('Starts', ['state'])
@@ -32,67 +38,107 @@ class Workflow(CharField):
         if not self.nodes:
             self.nodes = nodes
 
-        self._tree = DefaultDict(list)
-        self._states = DefaultDict(lambda: {
-            'starts': False,
-            'ends': False,
-            'transitions': [],
-            'transition_to': [],
-            'transition_from': []
-        })
+        self.compile()
 
-        for node in self.nodes:
-            self._tree[type(node)].append(node)
+        kwargs.setdefault('max_length', 20)
+        kwargs.setdefault('db_index', True)
+        kwargs['choices'] = tuple(self.get_state_choices())
+        super().__init__(**kwargs)
+
+    def compile(self):
+        """Build the lookup tables of the graph once, rejecting unknown states.
+
+        States get a bit each, the allowed next states of a state are a
+        bitmask, so state lookups and transition checks are dict and bitwise
+        operations.
+        """
+        tree = DefaultDict(list)
 
         for node in self.nodes:
-            if isinstance(node, self.Starts):
-                state = self.get_state(node.state)
-                self._states[state]['starts'] = True
+            tree[type(node)].append(node)
 
-            elif isinstance(node, self.Ends):
-                state = self.get_state(node.state)
-                self._states[state]['ends'] = True
+        self._tree = {node_type: tuple(nodes) for node_type, nodes in tree.items()}
 
-            elif isinstance(node, self.Transition):
-                from_state = self.get_state(node.from_state)
-                to_state = self.get_state(node.to_state)
+        states = self._tree.get(self.State, ())
+        self._state_index = MappingProxyType(OrderedDict((state.state, state) for state in states))
+        self._state_bits = MappingProxyType({state.state: 1 << position
+                                             for position, state in enumerate(states)})
 
-                if node not in self._states[from_state]['transitions']:
-                    self._states[from_state]['transitions'].append(node)
+        for node in self.nodes:
+            codes = (node.from_state, node.to_state) if isinstance(node, self.Transition) else (node.state,)
+            for code in codes:
+                if code not in self._state_index:
+                    raise ImproperlyConfigured('Unknown state %r in %r.' % (code, node))
+
+        next_masks = dict.fromkeys(self._state_index, 0)
+        previous_masks = dict.fromkeys(self._state_index, 0)
+        transitions = {}
+        next_states = {code: [] for code in self._state_index}
+
+        for transition in self.get_transitions():
+            key = (transition.from_state, transition.to_state)
+
+            if key not in transitions:
+                transitions[key] = transition
+                next_states[transition.from_state].append(transition)
+
+            next_masks[transition.from_state] |= self._state_bits[transition.to_state]
+            previous_masks[transition.to_state] |= self._state_bits[transition.from_state]
+
+        self._transitions = MappingProxyType(transitions)
+        self._next_masks = MappingProxyType(next_masks)
+        self._previous_states = MappingProxyType({
+            code: tuple(other for other, bit in self._state_bits.items() if mask & bit)
+            for code, mask in previous_masks.items()})
+        self._next_states = MappingProxyType({code: tuple(items) for code, items in next_states.items()})
+        self._starts = frozenset(node.state for node in self.get_starts())
+        self._ends = frozenset(node.state for node in self.get_ends())
+
+        # Graph description used by the renderers
+        self._states = OrderedDict((state, {
+            'starts': state.state in self._starts,
+            'ends': state.state in self._ends,
+            'transitions': list(self._next_states[state.state]),
+            'transition_to': [self._state_index[t.to_state] for t in self._next_states[state.state]],
+            'transition_from': [self._state_index[code] for code in self.get_previous_states(state.state)],
+        }) for state in states)
 
-                if to_state not in self._states[from_state]['transition_to']:
-                    self._states[from_state]['transition_to'].append(to_state)
+    def get_state(self, state_code):
+        try:
+            return self._state_index[state_code]
+        except KeyError:
+            raise ValueError('Unknown state: %s' % state_code)
 
-                if from_state not in self._states[to_state]['transition_from']:
-                    self._states[to_state]['transition_from'].append(from_state)
+    def can_transition(self, from_state, to_state):
+        """Return True if the graph allows moving from from_state to to_state."""
+        return bool(self._next_masks.get(from_state, 0) & self._state_bits.get(to_state, 0))
 
-        kwargs.setdefault('max_length', 20)
-        kwargs.setdefault('db_index', True)
-        kwargs['choices'] = self.get_state_choices()
-        super().__init__(**kwargs)
+    def get_transition(self, from_state, to_state):
+        return self._transitions.get((from_state, to_state))
 
-    def get_state(self, state_code):
-        for state in self._tree[self.State]:
-            if state.state == state_code:
-                return state
-        raise Exception('Unknown state: %s' % state_code)
+    def get_next_transitions(self, state_code):
+        return self._next_states.get(state_code, ())
+
+    def get_previous_states(self, state_code):
+        """Return the codes of the states allowed to move to state_code."""
+        return self._previous_states.get(state_code, ())
 
     def get_states(self):
-        return self._tree[self.State]
+        return self._tree.get(self.State, ())
 
     def get_starts(self):
-        return self._tree[self.Starts]
+        return self._tree.get(self.Starts, ())
 
     def get_ends(self):
-        return self._tree[self.Ends]
+        return self._tree.get(self.Ends, ())
 
     def get_transitions(self):
-        return self._tree[self.Transition]
+        return self._tree.get(self.Transition, ())
 
     def get_state_choices(self):
         """Return a choice like list of all available status."""
-        choices = list(set(chain(*((step.from_state, step.to_state) for step in self.get_transitions()))))
-        return [(choices, choices.title()) for choices in choices]
+        used = set(chain(*((step.from_state, step.to_state) for step in self.get_transitions())))
+        return [(code, code.title()) for code in self._state_index if code in used]
 
     @classmethod
     def transition(cls, state):
@@ -114,14 +160,19 @@ class Workflow(CharField):
         state_position = getattr(self, field.attname)
 
         return [(transition.to_state, transition.label.title())
-                for transition in field.transitions
-                if transition.to_state == state_position]
+                for transition in field.get_next_transitions(state_position)]
 
     def contribute_to_class(self, cls, name, virtual_only=False):
         super().contribute_to_class(cls, name, virtual_only)
 
         setattr(cls, 'current_state', self)
-        setattr(cls, 'get_next_states', curry(self._get_next_states, field=self))
+        # Curry the plain function, the model instance is passed as its first argument
+        setattr(cls, 'get_next_states', curry(type(self)._get_next_states, field=self))
+
+    def formfield(self, **kwargs):
+        cache_key = 'workflow:%s.%s' % (self.model._meta.label_lower, self.name)
+        kwargs.setdefault('widget', CachedChoicesSelect(cache_key=cache_key))
+        return super().formfield(**kwargs)
 
     def validate(self, value, model_instance):
         super().validate(value, model_instance)
@@ -131,3 +182,38 @@ class Workflow(CharField):
         name, path, args, kwargs = super().deconstruct()
         args = []
         return name, path, args, kwargs
+
+
+class WorkflowQuerySet(QuerySet):
+    def transition(self, field_name, to_state):
+        """Move every row allowed to reach to_state with a set based UPDATE.
+
+        Rows are locked and only those in a predecessor state of to_state are
+        updated, `Workflow.bulk_transition` is sent once with their pks instead
+        of validating each instance. Return an (updated, skipped pks) tuple.
+
+        The UPDATE is restricted to the locked pks, rows inserted meanwhile are
+        left alone. It's a single statement unless the database limits the
+        number of query parameters, as SQLite does.
+        """
+        field = self.model._meta.get_field(field_name)
+        field.get_state(to_state)
+        predecessors = field.get_previous_states(to_state)
+        manager = self.model._default_manager.db_manager(self.db)
+
+        with transaction.atomic(using=self.db):
+            pks, skipped, updated = [], [], 0
+
+            for pk, state in self.select_for_update().values_list('pk', field.attname).iterator():
+                (pks if state in predecessors else skipped).append(pk)
+
+            batch_size = max(connections[self.db].ops.bulk_batch_size(['pk'], pks), 1)
+
+            for start in range(0, len(pks), batch_size):
+                updated += manager.filter(pk__in=pks[start:start + batch_size]).update(
+                    **{field.attname: to_state})
+
+            if pks:
+                field.bulk_transition.send(sender=self.model, field=field, to_state=to_state, pks=pks)
+
+        return updated, skipped
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+"""
+Compare the storage and filter cost of BitFlagsField with FlagsField.
+
+FlagsField needs PostgreSQL (set TEST_DB_ENGINE and friends), on SQLite only
+BitFlagsField is measured.
+
+    python -m tests.bench_bit_flags --rows 100000
+"""
+
+import argparse
+import random
+import sys
+import time
+
+from tests.utils import setup_django
+
+
+def get_storage(model):
+    """Return the bytes used by the model table, indexes included."""
+    from django.db import connection
+
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('VACUUM ANALYZE %s' % model._meta.db_table)
+            cursor.execute('SELECT pg_total_relation_size(%s)', [model._meta.db_table])
+            return cursor.fetchone()[0]
+
+        cursor.execute('SELECT sum(pgsize) FROM dbstat WHERE name = %s', [model._meta.db_table])
+        return cursor.fetchone()[0]
+
+
+def timed_count(queryset, repeat):
+    started = time.time()
+    for _ in range(repeat):
+        count = queryset.count()
+    return count, (time.time() - started) / repeat
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    if not setup_django():
+        sys.exit('Django is not available.')
+
+    from tests.testapp import models
+
+    flags = [flag for flag, label in models.BENCH_FLAGS]
+    rows = [random.sample(flags, random.randint(0, 4)) for _ in range(args.rows)]
+    benched = [models.BitFlagged] + ([models.ArrayFlagged] if hasattr(models, 'ArrayFlagged') else [])
+
+    for model in benched:
+        model.objects.all().delete()
+        model.objects.bulk_create((model(flags=row) for row in rows), batch_size=500)
+
+        try:
+            storage = '%.1f KiB' % (get_storage(model) / 1024.0)
+        except Exception as err:
+            storage = 'unknown (%s)' % err
+
+        print('%s, %s rows, %s' % (model._meta.object_name, args.rows, storage))
+
+        for lookup, value in (('has_flag', 'flag3'),
+                              ('has_all_flags', ['flag3', 'flag7']),
+                              ('has_any_flags', ['flag3', 'flag7'])):
+            count, elapsed = timed_count(model.objects.filter(**{'flags__%s' % lookup: value}), args.repeat)
+            print('  %-14s %8s rows %8.2fms' % (lookup, count, elapsed * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+"""
+Compare recomputing a ComputeFields column row by row with `save()`, with
+`ComputeFields.backfill()` and with the single UPDATE of `ComputeFields.recompute()`.
+
+    python -m tests.bench_compute_fields --rows 20000
+"""
+
+import argparse
+import sys
+import time
+
+from tests.utils import setup_django
+
+
+def timed(label, func, rows):
+    started = time.time()
+    func()
+    elapsed = time.time() - started
+    print('%-12s %8.3fs %10.0f rows/s' % (label, elapsed, rows / elapsed if elapsed else 0))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=20000)
+    args = parser.parse_args(argv)
+
+    if not setup_django():
+        sys.exit('Django is not available.')
+
+    from django.db import transaction
+    from django.db.models import F
+    from tests.testapp.models import Order
+
+    Order.objects.all().delete()
+    Order.objects.bulk_create(Order(price=index % 100, quantity=index % 7) for index in range(args.rows))
+
+    def row_by_row():
+        with transaction.atomic():
+            for order in Order.objects.all():
+                order.price += 1
+                order.save()
+
+    def reset():
+        Order.objects.update(total=0)
+
+    def backfill():
+        Order.computed.backfill(Order.objects.all(), skip_expressions=False)
+
+    timed('save()', row_by_row, args.rows)
+    reset()
+    timed('backfill()', backfill, args.rows)
+    reset()
+    timed('recompute()', Order.computed.recompute, args.rows)
+
+    assert not Order.objects.exclude(total=F('price') * F('quantity')).exists()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,41 @@
+import os
+import tempfile
+
+SECRET_KEY = 'django-tricks-tests'
+
+INSTALLED_APPS = [
+    'django.contrib.contenttypes',
+    'django_tricks',
+    'tests.testapp',
+]
+
+# Every run gets its own directory, concurrent runs don't share the SQLite file
+TEST_DIR = tempfile.mkdtemp(prefix='django_tricks_tests_')
+
+# SQLite by default, set TEST_DB_ENGINE and friends to run against PostgreSQL
+DATABASES = {
+    'default': {
+        'ENGINE': os.environ.get('TEST_DB_ENGINE', 'django.db.backends.sqlite3'),
+        'NAME': os.environ.get('TEST_DB_NAME', os.path.join(TEST_DIR, 'db.sqlite3')),
+        'USER': os.environ.get('TEST_DB_USER', ''),
+        'PASSWORD': os.environ.get('TEST_DB_PASSWORD', ''),
+        'HOST': os.environ.get('TEST_DB_HOST', ''),
+        'PORT': os.environ.get('TEST_DB_PORT', ''),
+        # A file, threads and forked processes of the stress tests must see the same database
+        'TEST': {'NAME': os.environ.get('TEST_DB_TEST_NAME', os.path.join(TEST_DIR, 'test.sqlite3'))},
+    }
+}
+
+if 'postgresql' in DATABASES['default']['ENGINE']:
+    DATABASES['default']['TEST'] = {}
+
+TEMPLATES = [{
+    'BACKEND': 'django.template.backends.django.DjangoTemplates',
+    'OPTIONS': {
+        'loaders': [('django.template.loaders.locmem.Loader', {
+            'testapp/book_list.html': '{% for book in object_list %}{{ book.title }} {% endfor %}',
+        })],
+    },
+}]
+
+USE_TZ = True
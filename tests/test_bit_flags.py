@@ -0,0 +1,42 @@
+from tests.utils import DJANGO, TestCase
+
+if DJANGO:
+    from django import forms
+    from django.core.validators import MaxValueValidator, MinValueValidator
+
+    from tests.testapp.models import BitFlagged
+
+    class BitFlaggedForm(forms.ModelForm):
+        class Meta:
+            model = BitFlagged
+            fields = ['flags']
+
+
+class BitFlagsFieldTest(TestCase):
+
+    def test_range_validators_are_not_used(self):
+        field = BitFlagged._meta.get_field('flags')
+        self.assertFalse([validator for validator in field.validators
+                          if isinstance(validator, (MinValueValidator, MaxValueValidator))])
+
+    def test_full_clean_and_lookups(self):
+        obj = BitFlagged(flags=['flag1', 'flag15'])
+        obj.full_clean()
+        obj.save()
+
+        self.assertEqual(BitFlagged.objects.get().flags, ['flag1', 'flag15'])
+        self.assertEqual(BitFlagged.objects.filter(flags__has_flag='flag15').count(), 1)
+        self.assertEqual(BitFlagged.objects.filter(flags__has_all_flags=['flag1', 'flag2']).count(), 0)
+        self.assertEqual(BitFlagged.objects.filter(flags__has_any_flags=['flag1', 'flag2']).count(), 1)
+
+    def test_form_render_and_save(self):
+        html = str(BitFlaggedForm(instance=BitFlagged(flags=['flag1', 'flag15']))['flags'])
+
+        self.assertInHTML('<input type="checkbox" name="flags" value="flag1" id="id_flags_1" checked>', html)
+        self.assertInHTML('<input type="checkbox" name="flags" value="flag2" id="id_flags_2">', html)
+        self.assertNotIn('flags_add', html)
+
+        form = BitFlaggedForm(data={'flags': ['flag2', 'flag3']})
+        self.assertTrue(form.is_valid(), form.errors)
+        form.save()
+        self.assertEqual(BitFlagged.objects.get().flags, ['flag2', 'flag3'])
@@ -0,0 +1,53 @@
+from tests.utils import DJANGO, TestCase
+
+if DJANGO:
+    from django import forms
+    from django.utils import translation
+    from django.utils.functional import lazy
+
+    from django_tricks.models.fields import CachedChoicesSelect
+
+    language_label = lazy(lambda: 'Language %s' % translation.get_language(), str)
+
+CHOICES = [
+    ('', '---------'),
+    (1, 'One'),
+    ('Group', [(2, 'Two & a half'), (3, 'Three')]),
+    ('4', '<Four>'),
+]
+
+
+class CachedChoicesSelectTest(TestCase):
+
+    def setUp(self):
+        CachedChoicesSelect.rendered_options.clear()
+
+    def assertRendersLikeSelect(self, choices, value, cache_key='test'):
+        attrs = {'id': 'id_number', 'class': 'wide'}
+        expected = forms.Select(choices=choices).render('number', value, attrs)
+        widget = CachedChoicesSelect(choices=choices, cache_key=cache_key)
+
+        # Twice, the second render comes from the cached options
+        for _ in range(2):
+            self.assertHTMLEqual(widget.render('number', value, attrs), expected)
+
+    def test_matches_select(self):
+        for value in (None, '', 1, '1', 2, 3, '4', 'missing'):
+            with self.subTest(value=value):
+                self.assertRendersLikeSelect(CHOICES, value)
+
+    def test_without_cache_key(self):
+        self.assertRendersLikeSelect(CHOICES, 2, cache_key=None)
+        self.assertEqual(CachedChoicesSelect.rendered_options, {})
+
+    def test_per_language(self):
+        choices = [('a', language_label())]
+
+        with translation.override('en'):
+            self.assertRendersLikeSelect(choices, 'a')
+        with translation.override('fr'):
+            self.assertRendersLikeSelect(choices, 'a')
+            html = CachedChoicesSelect(choices=choices, cache_key='test').render('x', None)
+            self.assertIn('Language fr', html)
+
+        self.assertEqual(len(CachedChoicesSelect.rendered_options), 2)
@@ -0,0 +1,47 @@
+from tests.utils import DJANGO, TestCase
+
+if DJANGO:
+    from tests.testapp.models import Order
+
+
+class ComputeFieldsTest(TestCase):
+
+    def setUp(self):
+        self.order = Order.objects.create(price=3, quantity=2)
+
+    def test_every_field_uses_its_own_method(self):
+        order = Order.objects.get()
+
+        self.assertEqual((order.total, order.label), (6, '2 x 3'))
+
+    def test_unchanged_inputs_skip_the_compute(self):
+        order = Order.objects.get()
+        order.total = 0
+        order.save()
+
+        self.assertEqual(Order.objects.get().total, 0)
+
+        order.quantity = 4
+        order.save()
+
+        self.assertEqual(Order.objects.get().total, 12)
+
+    def test_stale_fields_added_to_update_fields(self):
+        self.order.price = 5
+        self.order.save(update_fields=['price'])
+
+        self.assertEqual(Order.objects.values_list('price', 'total').get(), (5, 10))
+
+    def test_deferred_inputs_are_not_changed(self):
+        Order.objects.update(total=0)
+        order = Order.objects.only('pk', 'total').get()
+        order.save()
+
+        self.assertEqual(Order.objects.get().total, 0)
+
+    def test_recompute_and_annotate(self):
+        Order.objects.update(total=0)
+
+        self.assertEqual(Order.computed.recompute(), 1)
+        self.assertEqual(Order.objects.get().total, 6)
+        self.assertEqual(Order.computed.annotate(Order.objects.all()).get().computed_total, 6)
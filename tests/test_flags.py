@@ -0,0 +1,98 @@
+from tests.utils import DJANGO, TestCase, TransactionTestCase, is_postgresql, requires_postgresql
+
+if DJANGO:
+    from django import forms
+    from django.core.cache import cache
+
+    from django_tricks.models.flags import flag_counts
+
+if is_postgresql():
+    from tests.testapp.models import ArrayFlagged
+
+    class ArrayFlaggedForm(forms.ModelForm):
+        class Meta:
+            model = ArrayFlagged
+            fields = ['flags']
+
+
+@requires_postgresql
+class FlagLookupsTest(TestCase):
+
+    def setUp(self):
+        ArrayFlagged.objects.create(flags=['flag1', 'flag2'])
+        ArrayFlagged.objects.create(flags=['flag2', 'flag3'])
+        ArrayFlagged.objects.create(flags=[])
+
+    def test_lookups(self):
+        flagged = ArrayFlagged.objects.all()
+
+        self.assertEqual(flagged.filter(flags__has_flag='flag2').count(), 2)
+        self.assertEqual(flagged.filter(flags__has_all_flags=['flag1', 'flag2']).count(), 1)
+        self.assertEqual(flagged.filter(flags__has_all_flags=['flag1', 'flag3']).count(), 0)
+        self.assertEqual(flagged.filter(flags__has_any_flags=['flag1', 'flag3']).count(), 2)
+        self.assertIn('@>', str(flagged.filter(flags__has_flag='flag2').query))
+
+    def test_gin_index(self):
+        self.assertEqual([index.fields for index in ArrayFlagged._meta.indexes], [['flags']])
+
+    def test_flag_counts(self):
+        self.assertEqual(flag_counts(ArrayFlagged.objects.all(), 'flags'),
+                         {'flag1': 1, 'flag2': 2, 'flag3': 1})
+        self.assertEqual(flag_counts(ArrayFlagged.objects.filter(flags__has_flag='flag1'), 'flags'),
+                         {'flag1': 1, 'flag2': 1})
+        self.assertEqual(flag_counts(ArrayFlagged.objects.none(), 'flags'), {})
+
+
+@requires_postgresql
+class FlagVocabularyTest(TransactionTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.vocabulary = ArrayFlagged._meta.get_field('flags').vocabulary
+        self.first = ArrayFlagged.objects.create(flags=['flag1', 'flag2'])
+        self.second = ArrayFlagged.objects.create(flags=['flag1'])
+
+    def test_counts_follow_saves_and_deletes(self):
+        self.assertEqual(self.vocabulary.counts(), {'flag1': 2, 'flag2': 1})
+
+        ArrayFlagged.objects.create(flags=['new'])
+        self.first.flags = ['flag2', 'flag3']
+        self.first.save()
+        self.second.delete()
+
+        self.assertEqual(self.vocabulary.flags(), [('flag2', 1), ('flag3', 1), ('new', 1)])
+        self.assertEqual(self.vocabulary.counts(), flag_counts(ArrayFlagged.objects.all(), 'flags'))
+
+    def test_new_flag_gets_a_single_name(self):
+        self.vocabulary.counts()
+        self.vocabulary.update({'new'}, set())
+        self.vocabulary.update({'new'}, set())
+
+        generation = cache.get(self.vocabulary.generation_key)
+        self.assertEqual(cache.get(self.vocabulary.size_key(generation)), 3)
+        self.assertEqual(self.vocabulary.counts(), {'flag1': 2, 'flag2': 1, 'new': 2})
+
+    def test_deferred_instance_leaves_counts_alone(self):
+        self.vocabulary.counts()
+
+        obj = ArrayFlagged.objects.defer('flags').get(pk=self.second.pk)
+        obj.flags = ['flag3']
+        obj.save()
+
+        self.assertEqual(self.vocabulary.counts(), {'flag1': 2, 'flag2': 1})
+        self.assertEqual(self.vocabulary.rebuild(), {'flag1': 1, 'flag2': 1, 'flag3': 1})
+
+    def test_rebuild_drops_previous_counts(self):
+        self.vocabulary.counts()
+        ArrayFlagged.objects.all().delete()
+
+        self.assertEqual(self.vocabulary.rebuild(), {})
+        self.assertEqual(self.vocabulary.counts(), {})
+
+    def test_widget_lists_used_flags(self):
+        ArrayFlagged.objects.create(flags=['new'])
+        html = str(ArrayFlaggedForm(instance=self.first)['flags'])
+
+        self.assertInHTML('<input type="checkbox" name="flags" value="flag1" id="id_flags_1" checked>', html)
+        self.assertIn('value="new"', html)
+        self.assertIn('name="flags_add"', html)
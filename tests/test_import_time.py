@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+"""
+Track the cost of importing django_tricks.models.fields, the pint registry,
+the timezone choices and the postgres fields must only load on first use.
+
+    python -m tests.test_import_time
+"""
+
+import json
+import subprocess
+import sys
+import unittest
+
+from tests.utils import DJANGO, has_module
+
+HEAVY_MODULES = ('pint', 'pytz', 'numpy')
+
+if sys.version_info >= (3, 7):
+    # Older versions have no module __getattr__ to load the flags fields lazily
+    HEAVY_MODULES += ('psycopg2', 'django.contrib.postgres')
+
+MEASURE = '''
+import json, sys, time
+import django.db.models, django.forms
+before = set(sys.modules)
+started = time.time()
+import django_tricks.models.fields
+elapsed = time.time() - started
+print(json.dumps({'elapsed': elapsed, 'modules': sorted(set(sys.modules) - before)}))
+'''
+
+
+def measure():
+    """Import the module in a fresh interpreter, return the seconds and the modules it loaded."""
+    output = subprocess.check_output([sys.executable, '-c', MEASURE])
+    result = json.loads(output.decode())
+    return result['elapsed'], result['modules']
+
+
+@unittest.skipUnless(DJANGO, 'Django is not available')
+class ImportTimeTest(unittest.TestCase):
+
+    def test_heavy_modules_are_not_imported(self):
+        modules = measure()[1]
+        loaded = [name for name in modules
+                  if any(name == heavy or name.startswith('%s.' % heavy) for heavy in HEAVY_MODULES)]
+
+        self.assertEqual(loaded, [])
+
+    def test_timezone_choices(self):
+        from django_tricks.models.fields import TIMEZONE_CHOICES
+
+        self.assertIn(('Europe/Paris', 'Europe/Paris'), TIMEZONE_CHOICES)
+
+    @unittest.skipUnless(has_module('pint'), 'Needs pint')
+    def test_unit_registry(self):
+        from django_tricks.models.fields import ureg
+
+        self.assertEqual(ureg('3 km').to('m').magnitude, 3000)
+        self.assertEqual(ureg.Quantity(2, 'm').magnitude, 2)
+
+
+if __name__ == '__main__':
+    elapsed, modules = measure()
+    print('django_tricks.models.fields imported in %.1fms, %s new modules' % (elapsed * 1000, len(modules)))
@@ -0,0 +1,48 @@
+import warnings
+
+from tests.utils import DJANGO, TestCase
+
+if DJANGO:
+    from django.test import RequestFactory
+    from django.test.utils import override_settings
+
+    from django_tricks.views.generic import MasterDetailExportView, QueryBudgetWarning
+    from tests.testapp.models import Author, Book
+
+    class BooksView(MasterDetailExportView):
+        belongs_model = Author
+        related_name = 'books'
+        export_fields = ['title']
+        conditional_get = True
+        belongs_modified_field = 'modified'
+
+
+class MasterDetailViewTest(TestCase):
+
+    def setUp(self):
+        self.author = Author.objects.create(name='Ursula')
+        Book.objects.create(author=self.author, title='The Dispossessed')
+
+    def get(self, view_class=None, **headers):
+        return (view_class or BooksView).as_view()(RequestFactory().get('/', **headers), pk=self.author.pk)
+
+    def test_not_modified(self):
+        response = self.get()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'title\r\nThe Dispossessed\r\n')
+        self.assertTrue(response['ETag'].startswith('"'))
+
+        response = self.get(HTTP_IF_NONE_MATCH=response['ETag'],
+                            HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+
+        self.assertEqual(response.status_code, 304)
+
+    def test_query_budget(self):
+        view_class = type('BudgetView', (BooksView,), {'query_budget': 0})
+
+        with override_settings(DEBUG=True), warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            self.get(view_class)
+
+        self.assertTrue([warning for warning in caught if issubclass(warning.category, QueryBudgetWarning)])
@@ -0,0 +1,45 @@
+from io import StringIO
+
+from tests.utils import DJANGO, TestCase
+
+if DJANGO:
+    from django.core.management import call_command
+    from django.db import connection
+
+    from tests.testapp.models import Product
+
+
+def insert_raw(code, email):
+    with connection.cursor() as cursor:
+        sql = 'INSERT INTO %s (code, email) VALUES (%%s, %%s)' % Product._meta.db_table
+        cursor.execute(sql, [code, email])
+
+
+class NormalizedCharFieldTest(TestCase):
+
+    def test_no_converter_without_normalize_reads(self):
+        email = Product._meta.get_field('email')
+        code = Product._meta.get_field('code')
+
+        self.assertEqual(email.get_db_converters(connection), [])
+        self.assertEqual(code.get_db_converters(connection), [code.from_db_value])
+
+    def test_writes_are_normalized(self):
+        obj = Product.objects.create(code='abc', email='John@Example.COM')
+        self.assertEqual((obj.code, obj.email), ('ABC', 'john@example.com'))
+
+        Product.objects.update(email='Jane@Example.COM')
+        self.assertEqual(Product.objects.filter(email='jane@example.com').count(), 1)
+        self.assertEqual(Product.objects.filter(email='JANE@example.com').count(), 1)
+
+    def test_lookups_match_not_normalized_rows_while_normalizing_reads(self):
+        insert_raw('abc', 'old@example.com')
+
+        self.assertEqual(Product.objects.get().code, 'ABC')
+        self.assertEqual(Product.objects.filter(code='abc').count(), 1)
+
+    def test_normalize_command(self):
+        insert_raw('abc', 'Old@Example.com')
+        call_command('normalize_char_fields', 'testapp.Product', stdout=StringIO())
+
+        self.assertEqual(Product.objects.filter(code='ABC', email='old@example.com').count(), 1)
@@ -0,0 +1,142 @@
+import multiprocessing
+import threading
+
+from tests.utils import DJANGO, TransactionTestCase, requires_postgresql
+
+if DJANGO:
+    from django.db import connection, connections, transaction
+
+    from django_tricks.models.numbering import CounterAllocator, SequenceAllocator
+    from tests.testapp.models import Invoice, NumberCounter
+
+THREADS = 8
+PROCESSES = 4
+PER_WORKER = 25
+
+
+def close_connections():
+    # Threads and forked workers must not share the parent database connections
+    for conn in connections.all():
+        conn.close()
+
+
+def run_threads(target):
+    results, errors = [], []
+
+    def worker():
+        try:
+            results.extend(target())
+        except Exception as err:
+            errors.append(err)
+        finally:
+            close_connections()
+
+    threads = [threading.Thread(target=worker) for _ in range(THREADS)]
+
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    if errors:
+        raise errors[0]
+
+    return results
+
+
+def get_block_allocator():
+    return CounterAllocator(NumberCounter, gapless=False, block_size=10)
+
+
+def get_allocator(name):
+    return get_block_allocator() if name == 'block' else SequenceAllocator()
+
+
+def allocate_in_process(args):
+    allocator_name, prefix = args
+    close_connections()
+    allocator = get_allocator(allocator_name)
+    return [allocator.allocate(prefix) for _ in range(PER_WORKER)]
+
+
+def run_processes(allocator_name, prefix, tasks):
+    close_connections()
+
+    with multiprocessing.get_context('fork').Pool(PROCESSES) as pool:
+        results = pool.map(allocate_in_process, [(allocator_name, prefix)] * tasks)
+
+    return [number for result in results for number in result]
+
+
+class AllocatorStressTest(TransactionTestCase):
+    """Many threads and processes allocating numbers of the same prefix never get duplicates."""
+
+    def setUp(self):
+        NumberCounter.objects.create(prefix='invoice')
+
+    def test_gapless_threads(self):
+        numbers = run_threads(lambda: [Invoice.objects.create().number for _ in range(PER_WORKER)])
+        expected = [Invoice().format_number(value) for value in range(1, THREADS * PER_WORKER + 1)]
+
+        self.assertEqual(sorted(numbers), sorted(expected))
+
+    def test_block_threads(self):
+        allocator = get_block_allocator()
+        numbers = run_threads(lambda: [allocator.allocate('invoice') for _ in range(PER_WORKER)])
+
+        self.assertEqual(len(numbers), THREADS * PER_WORKER)
+        self.assertEqual(len(set(numbers)), len(numbers))
+
+    def test_block_processes(self):
+        numbers = run_processes('block', 'invoice', PROCESSES * 2)
+
+        self.assertEqual(len(numbers), PROCESSES * 2 * PER_WORKER)
+        self.assertEqual(len(set(numbers)), len(numbers))
+
+    def test_block_rolled_back_reservation(self):
+        first, second = get_block_allocator(), get_block_allocator()
+
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                first.allocate('invoice')
+                raise RuntimeError()
+
+        numbers = [allocator.allocate('invoice') for allocator in (first, second) for _ in range(5)]
+
+        self.assertEqual(len(set(numbers)), len(numbers))
+
+    @requires_postgresql
+    def test_block_reserved_outside_transaction(self):
+        first = get_block_allocator()
+
+        with transaction.atomic():
+            first.allocate('invoice')
+            # The counter row is not locked until this transaction ends
+            numbers = run_threads(lambda: [get_block_allocator().allocate('invoice')])
+
+        self.assertEqual(len(set(numbers)), THREADS)
+
+    @requires_postgresql
+    def test_sequence_threads_and_processes(self):
+        allocator = SequenceAllocator()
+        numbers = run_threads(lambda: [allocator.allocate('stress') for _ in range(PER_WORKER)])
+        numbers += run_processes('sequence', 'stress', PROCESSES)
+
+        self.assertEqual(len(set(numbers)), len(numbers))
+
+    @requires_postgresql
+    def test_sequence_rolled_back_creation(self):
+        allocator = SequenceAllocator()
+        name = allocator.get_sequence_name('rolled back')
+
+        with connection.cursor() as cursor:
+            cursor.execute('DROP SEQUENCE IF EXISTS %s' % name)
+
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                allocator.allocate('rolled back')
+                raise RuntimeError()
+
+        self.assertNotIn(name, allocator.created)
+        self.assertEqual(allocator.allocate('rolled back'), 1)
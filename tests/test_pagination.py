@@ -0,0 +1,156 @@
+import datetime
+
+from tests.utils import DJANGO, TestCase, requires_postgresql
+
+if DJANGO:
+    from django.core.cache import cache
+    from django.core.paginator import EmptyPage
+    from django.db import connection
+    from django.http import Http404
+    from django.test import RequestFactory
+    from django.utils import timezone
+
+    from django_tricks.views.generic import MasterDetailView
+    from django_tricks.views.pagination import CountingPaginator, KeysetPaginator
+    from tests.testapp.models import Author, Book
+
+    class KeysetBooksView(MasterDetailView):
+        belongs_model = Author
+        related_name = 'books'
+        paginate_by = 3
+        pagination_mode = 'keyset'
+        keyset_ordering = ['-published']
+        template_name = 'testapp/book_list.html'
+
+
+class KeysetPaginatorTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = Author.objects.create(name='Ursula')
+        start = timezone.now().replace(microsecond=0)
+
+        # Timestamps only differing in microseconds, and two equal ones to tie break on pk
+        for index in range(10):
+            published = start + datetime.timedelta(microseconds=min(index, 8))
+            Book.objects.create(author=cls.author, title='Book %s' % index, published=published)
+
+    def walk(self, ordering, per_page=3):
+        paginator = KeysetPaginator(Book.objects.all(), per_page, ordering=ordering)
+        forward, page = [], paginator.page()
+        forward.extend(page)
+
+        while page.has_next():
+            page = paginator.page(page.next_cursor)
+            forward.extend(page)
+
+        backward = list(page)
+
+        while page.has_previous():
+            page = paginator.page(page.previous_cursor)
+            backward[:0] = page
+
+        return forward, backward
+
+    def test_walk_datetime_orderings(self):
+        for ordering in (['published'], ['-published'], ['-published', 'pk']):
+            paginator = KeysetPaginator(Book.objects.all(), 3, ordering=ordering)
+            expected = list(Book.objects.order_by(*paginator.get_order_by()))
+            forward, backward = self.walk(ordering)
+
+            self.assertEqual(forward, expected, ordering)
+            self.assertEqual(backward, expected, ordering)
+
+    def test_walk_descending_pk(self):
+        expected = list(Book.objects.order_by('-pk'))
+        self.assertEqual(self.walk(['-pk'], per_page=4), (expected, expected))
+
+    def get(self, cursor=None):
+        data = {'cursor': cursor} if cursor else {}
+        return KeysetBooksView.as_view()(RequestFactory().get('/', data), pk=self.author.pk)
+
+    def test_view_cursors(self):
+        response = self.get()
+        response.render()
+        next_cursor = response.context_data['next_cursor']
+
+        self.assertEqual(response.content.decode().split(), ['Book', '9', 'Book', '8', 'Book', '7'])
+
+        response = self.get(next_cursor)
+        response.render()
+
+        self.assertEqual(response.content.decode().split(), ['Book', '6', 'Book', '5', 'Book', '4'])
+
+    def test_tampered_cursor(self):
+        cursor = KeysetPaginator(Book.objects.all(), 3, ordering=['-published']).page().next_cursor
+
+        with self.assertRaises(Http404):
+            self.get(cursor[:-1] + ('A' if cursor[-1] != 'A' else 'B'))
+
+        with self.assertRaises(Http404):
+            self.get('not-a-cursor')
+
+
+def get_books():
+    return Book.objects.order_by('pk')
+
+
+class CountingPaginatorTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        author = Author.objects.create(name='Ursula')
+        Book.objects.bulk_create(Book(author=author, title='Book %s' % index) for index in range(12))
+
+    def setUp(self):
+        cache.clear()
+
+    def test_exact(self):
+        paginator = CountingPaginator(get_books(), 5)
+
+        self.assertEqual((paginator.count, paginator.count_is_exact), (12, True))
+        self.assertEqual(paginator.count_display, '12')
+        self.assertEqual(paginator.num_pages, 3)
+
+    def test_capped(self):
+        paginator = CountingPaginator(get_books(), 2, count_mode='capped', count_cap=5)
+
+        self.assertEqual((paginator.count, paginator.count_is_exact), (5, False))
+        self.assertEqual(paginator.count_display, '5+')
+        self.assertEqual(len(paginator.page(3)), 1)
+
+        with self.assertRaises(EmptyPage):
+            paginator.page(4)
+
+        paginator = CountingPaginator(get_books(), 2, count_mode='capped', count_cap=12)
+        self.assertEqual((paginator.count, paginator.count_is_exact), (12, True))
+
+    def test_estimate_falls_back_to_an_exact_count(self):
+        paginator = CountingPaginator(get_books(), 5, count_mode='estimate', count_cap=1000)
+
+        self.assertEqual((paginator.count, paginator.count_is_exact), (12, True))
+
+    @requires_postgresql
+    def test_estimate(self):
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE %s' % Book._meta.db_table)
+
+        paginator = CountingPaginator(get_books(), 5, count_mode='estimate', count_cap=1)
+
+        self.assertFalse(paginator.count_is_exact)
+        self.assertEqual(paginator.count, paginator.estimate_count(Book.objects.all()))
+        self.assertTrue(paginator.count_display.endswith('+'))
+
+    def test_cached(self):
+        self.assertEqual(CountingPaginator(get_books(), 5, cache_key='books').count, 12)
+
+        Book.objects.all()[0].delete()
+
+        self.assertEqual(CountingPaginator(get_books(), 5, cache_key='books').count, 12)
+        self.assertEqual(CountingPaginator(get_books(), 5).count, 11)
+
+    def test_count_display_grouping(self):
+        with self.settings(USE_L10N=True, LANGUAGE_CODE='en'):
+            self.assertEqual(CountingPaginator(range(12345), 10).count_display, '12,345')
+            paginator = CountingPaginator(get_books(), 5, count_mode='capped', count_cap=10)
+            self.assertEqual(paginator.count_display, '10+')
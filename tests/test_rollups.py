@@ -0,0 +1,89 @@
+from tests.utils import DJANGO, TestCase, requires_treebeard
+
+if DJANGO:
+    from io import StringIO
+
+    from django.core.management import call_command
+
+    try:
+        from tests.testapp.models import Category, Item
+    except ImportError:
+        pass
+
+
+def get_rollups():
+    return {slug: (count, stock) for slug, count, stock
+            in Category.objects.values_list('slug', 'item_count', 'stock')}
+
+
+@requires_treebeard
+class RollupTest(TestCase):
+
+    def setUp(self):
+        self.shop = Category.add_root(name='Shop', slug='shop')
+        self.books = self.shop.add_child(name='Books', slug='books')
+        self.novels = self.books.add_child(name='Novels', slug='novels')
+        self.archive = Category.add_root(name='Archive', slug='archive')
+
+        self.novel = Item.objects.create(category=self.novels, quantity=5)
+        self.book = Item.objects.create(category=self.books, quantity=2)
+
+    def test_create(self):
+        self.assertEqual(get_rollups(),
+                         {'shop': (2, 7), 'books': (2, 7), 'novels': (1, 5), 'archive': (0, 0)})
+
+    def test_change_value_and_node(self):
+        self.novel.quantity = 8
+        self.novel.save()
+
+        self.assertEqual(get_rollups(),
+                         {'shop': (2, 10), 'books': (2, 10), 'novels': (1, 8), 'archive': (0, 0)})
+
+        self.novel.category = self.archive
+        self.novel.save()
+
+        self.assertEqual(get_rollups(),
+                         {'shop': (1, 2), 'books': (1, 2), 'novels': (0, 0), 'archive': (1, 8)})
+
+        self.novel.category = None
+        self.novel.save()
+
+        self.assertEqual(get_rollups()['archive'], (0, 0))
+
+    def test_delete(self):
+        self.book.delete()
+
+        self.assertEqual(get_rollups(),
+                         {'shop': (1, 5), 'books': (1, 5), 'novels': (1, 5), 'archive': (0, 0)})
+
+        Item.objects.get(pk=self.novel.pk).delete()
+
+        self.assertEqual(set(get_rollups().values()), {(0, 0)})
+
+    def test_delete_node(self):
+        Category.objects.get(pk=self.novels.pk).delete()
+
+        self.assertEqual(get_rollups(), {'shop': (1, 2), 'books': (1, 2), 'archive': (0, 0)})
+
+    def test_move_subtree(self):
+        Category.objects.get(pk=self.books.pk).move(self.archive, 'last-child')
+
+        self.assertEqual(get_rollups(),
+                         {'shop': (0, 0), 'books': (2, 7), 'novels': (1, 5), 'archive': (2, 7)})
+
+    def test_recompute(self):
+        expected = get_rollups()
+        Category.objects.update(item_count=0, stock=100)
+
+        self.assertEqual(Category.recompute_rollups(chunk_size=2), 4)
+        self.assertEqual(get_rollups(), expected)
+        self.assertEqual(Category.recompute_rollups(), 0)
+
+    def test_recompute_command(self):
+        Category.objects.filter(slug='shop').update(item_count=0)
+        out = StringIO()
+
+        call_command('recompute_tree_rollups', 'testapp.Category', stdout=out)
+
+        self.assertEqual(out.getvalue().strip(), 'Updated 1 nodes of testapp.Category.')
+        self.assertEqual(get_rollups()['shop'], (2, 7))
@@ -0,0 +1,69 @@
+from tests.utils import DJANGO, TestCase, requires_treebeard
+
+if DJANGO:
+    try:
+        from tests.testapp.models import Category
+    except ImportError:
+        pass
+
+
+def node(name, *children):
+    return {'data': {'name': name, 'slug': name.lower()}, 'children': list(children)}
+
+
+@requires_treebeard
+class TreeLoaderTest(TestCase):
+
+    def assertValidTree(self):
+        self.assertEqual(Category.find_problems(), ([], [], [], [], []))
+
+    def test_bulk_load(self):
+        inserted = Category.bulk_load([
+            node('Shop', node('Books', node('Novels')), node('Music')),
+            node('Archive'),
+        ], batch_size=2)
+
+        self.assertEqual(inserted, 5)
+        self.assertValidTree()
+        self.assertEqual(Category.objects.get(slug='shop').numchild, 2)
+        self.assertEqual(Category.objects.get(slug='novels').name_path, 'Shop > Books > Novels')
+        self.assertEqual([category.slug for category in Category.get_root_nodes()], ['shop', 'archive'])
+
+    def test_append_under_existing_parent(self):
+        shop = Category.add_root(name='Shop', slug='shop')
+        shop.add_child(name='Books', slug='books')
+        shop.refresh_from_db()
+
+        Category.bulk_load([node('Music', node('Jazz')), node('Films')], parent=shop)
+
+        shop.refresh_from_db()
+        self.assertValidTree()
+        self.assertEqual(shop.numchild, 3)
+        self.assertEqual([category.slug for category in shop.get_children()], ['books', 'music', 'films'])
+        self.assertEqual(Category.objects.get(slug='jazz').slug_path, 'shop/music/jazz')
+
+    def test_append_roots(self):
+        Category.add_root(name='Shop', slug='shop')
+        Category.bulk_load([node('Archive')])
+
+        self.assertValidTree()
+        self.assertEqual([category.slug for category in Category.get_root_nodes()], ['shop', 'archive'])
+
+    def test_path_overflow(self):
+        shop = Category.add_root(name='Shop', slug='shop')
+        last = shop.add_child(name='Last', slug='last')
+        Category.objects.filter(pk=last.pk).update(path=shop.path + 'ZZZZ')
+        shop.refresh_from_db()
+
+        with self.assertRaisesRegex(ValueError, 'Path overflow'):
+            Category.bulk_load([node('Books')], parent=shop)
+
+        self.assertEqual(Category.objects.count(), 2)
+
+    def test_rows_must_be_listed_parents_first(self):
+        rows = [(1, None, {'name': 'Shop'}), (2, 3, {'name': 'Novels'}), (3, 1, {'name': 'Books'})]
+
+        with self.assertRaisesRegex(ValueError, 'level by level'):
+            Category.bulk_load_rows(rows)
+
+        self.assertEqual(Category.objects.count(), 0)
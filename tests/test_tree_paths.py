@@ -0,0 +1,74 @@
+from tests.utils import DJANGO, TestCase, requires_treebeard
+
+if DJANGO:
+    from io import StringIO
+
+    from django.core.management import CommandError, call_command
+
+    try:
+        from tests.testapp.models import Category
+    except ImportError:
+        pass
+
+
+def get_paths():
+    return list(Category.objects.order_by('path').values_list('name_path', 'slug_path'))
+
+
+@requires_treebeard
+class StoredPathsTest(TestCase):
+
+    def setUp(self):
+        self.shop = Category.add_root(name='Shop', slug='shop')
+        self.books = self.shop.add_child(name='Books', slug='books')
+        self.novels = self.books.add_child(name='Novels', slug='novels')
+        self.archive = Category.add_root(name='Archive', slug='archive')
+
+    def test_stored_paths(self):
+        self.assertEqual(self.novels.name_path, 'Shop > Books > Novels')
+        self.assertEqual(self.novels.get_name_path(), 'Shop > Books > Novels')
+        self.assertEqual(self.novels.get_name_path(separator='/'), 'Shop/Books/Novels')
+        self.assertEqual(self.novels.get_slug_path(), 'shop/books/novels')
+        self.assertEqual(Category.get_by_slug_path('shop/books/novels'), self.novels)
+
+    def test_rename_propagates_to_descendants(self):
+        self.shop.name, self.shop.slug = 'Store', 'store'
+        self.shop.save()
+
+        self.assertEqual(get_paths(), [
+            ('Store', 'store'),
+            ('Store > Books', 'store/books'),
+            ('Store > Books > Novels', 'store/books/novels'),
+            ('Archive', 'archive'),
+        ])
+
+    def test_move(self):
+        self.books.move(self.archive, 'last-child')
+
+        self.assertEqual(get_paths(), [
+            ('Shop', 'shop'),
+            ('Archive', 'archive'),
+            ('Archive > Books', 'archive/books'),
+            ('Archive > Books > Novels', 'archive/books/novels'),
+        ])
+
+    def test_chunked_rebuild(self):
+        expected = get_paths()
+        Category.objects.update(name_path='', slug_path='')
+
+        self.assertEqual(Category.rebuild_stored_paths(chunk_size=2), 4)
+        self.assertEqual(get_paths(), expected)
+        self.assertEqual(Category.rebuild_stored_paths(chunk_size=2), 0)
+
+    def test_rebuild_command(self):
+        expected = get_paths()
+        Category.objects.filter(slug='novels').update(slug_path='stale')
+        out = StringIO()
+
+        call_command('rebuild_tree_paths', 'testapp.Category', '--chunk-size', '1', stdout=out)
+
+        self.assertEqual(out.getvalue().strip(), 'Updated 1 nodes of testapp.Category.')
+        self.assertEqual(get_paths(), expected)
+
+        with self.assertRaises(CommandError):
+            call_command('rebuild_tree_paths', 'testapp.Book')
@@ -0,0 +1,64 @@
+from tests.utils import DJANGO, TransactionTestCase, requires_treebeard
+
+if DJANGO:
+    from django.core.cache import cache
+
+    from django_tricks.models.trees import TreeSnapshotCache, tree_snapshots
+
+    try:
+        from tests.testapp.models import Category
+    except ImportError:
+        pass
+
+
+@requires_treebeard
+class TreeSnapshotCacheTest(TransactionTestCase):
+
+    def setUp(self):
+        cache.clear()
+        tree_snapshots.snapshots.clear()
+        self.root = Category.add_root(name='Root', slug='root')
+        self.root.add_child(name='Child', slug='child')
+
+    def test_snapshot_kept_until_the_tree_changes(self):
+        snapshot = Category.get_snapshot()
+
+        self.assertIs(Category.get_snapshot(), snapshot)
+        self.assertEqual([row.slug for row in snapshot.get_descendants()], ['root', 'child'])
+
+        self.root.add_child(name='Other', slug='other')
+
+        self.assertIsNot(Category.get_snapshot(), snapshot)
+        self.assertEqual(len(Category.get_snapshot()), 3)
+
+    def test_other_processes_see_the_change(self):
+        other = TreeSnapshotCache()
+        snapshot = other.get(Category)
+
+        Category.objects.get(slug='child').delete()
+
+        self.assertIsNot(other.get(Category), snapshot)
+        self.assertEqual(len(other.get(Category)), 1)
+
+    def test_cache_without_versions_always_reloads(self):
+        with self.settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}):
+            self.assertEqual(len(Category.get_snapshot()), 2)
+
+            Category.objects.filter(slug='child').update(slug='renamed')
+
+            rows = Category.get_snapshot().get_descendants()
+            self.assertEqual([row.slug for row in rows], ['root', 'renamed'])
+            self.assertEqual(tree_snapshots.memory_usage(), {})
+
+    def test_memory_usage(self):
+        Category.get_snapshot()
+        small = tree_snapshots.memory_usage()['testapp.Category']
+
+        for position in range(20):
+            self.root.add_child(name='Node %s' % position, slug='node-%s' % position)
+
+        Category.get_snapshot()
+        usage = tree_snapshots.memory_usage()
+
+        self.assertEqual(list(usage), ['testapp.Category'])
+        self.assertGreater(usage['testapp.Category'], small)
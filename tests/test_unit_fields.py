@@ -0,0 +1,66 @@
+import unittest
+
+from tests.utils import DJANGO, TestCase, has_module
+
+if DJANGO:
+    from django.db.models import Count, Max, Sum
+
+    from django_tricks.models.fields import UnitDimensionError, UnitValue, ureg
+    from tests.testapp.models import Trip
+
+requires_pint = unittest.skipUnless(has_module('pint') and has_module('numpy'), 'Needs pint and numpy')
+
+
+@requires_pint
+class UnitFieldTest(TestCase):
+
+    def setUp(self):
+        for distance in (500, 1500, 2500, None):
+            Trip.objects.create(distance=distance)
+
+    def test_lookups_convert_quantities(self):
+        trips = Trip.objects.all()
+
+        self.assertEqual(trips.filter(distance__gt=ureg.Quantity(1, 'km')).count(), 2)
+        kilometers = (ureg.Quantity(1, 'km'), ureg.Quantity(2, 'km'))
+        self.assertEqual(trips.filter(distance__range=kilometers).count(), 1)
+        self.assertEqual(trips.filter(distance__lte=1000).count(), 1)
+
+    def test_dimension_error(self):
+        with self.assertRaises(UnitDimensionError):
+            Trip.objects.filter(distance__gt=ureg.Quantity(1, 'second'))
+
+    def test_get_prep_value(self):
+        field = Trip._meta.get_field('distance')
+
+        self.assertEqual(field.get_prep_value(ureg.Quantity(2, 'km')), 2000)
+        self.assertEqual(field.get_prep_value(3.5), 3.5)
+        self.assertIsNone(field.get_prep_value(None))
+
+        trip = Trip.objects.create(distance=ureg.Quantity(3, 'km'))
+        self.assertEqual(Trip.objects.values_list('distance', flat=True).get(pk=trip.pk), 3000)
+
+    def test_quantities(self):
+        import numpy
+
+        quantity = Trip.objects.order_by('pk').quantities('distance')
+
+        self.assertEqual(str(quantity.units), 'meter')
+        self.assertEqual(list(quantity.magnitude[:3]), [500, 1500, 2500])
+        self.assertTrue(numpy.isnan(quantity.magnitude[3]))
+
+        kilometers = Trip.objects.order_by('pk').quantities('distance', unit='km')
+        self.assertEqual(list(kilometers.magnitude[:3]), [0.5, 1.5, 2.5])
+
+    def test_aggregate_quantities(self):
+        result = Trip.objects.aggregate_quantities(Sum('distance'), Count('pk'), longest=Max('distance'))
+
+        self.assertEqual(result['distance__sum'], ureg.Quantity(4500, 'm'))
+        self.assertEqual(result['longest'].to('km').magnitude, 2.5)
+        self.assertEqual(result['pk__count'], 4)
+
+    def test_unit_values(self):
+        values = Trip.objects.order_by('pk').unit_values('distance')
+
+        self.assertEqual(values, [UnitValue(500, 'm'), UnitValue(1500, 'm'), UnitValue(2500, 'm'), None])
+        self.assertEqual(str(values[0]), '500.0 m')
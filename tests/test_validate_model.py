@@ -0,0 +1,52 @@
+import datetime
+
+from tests.utils import DJANGO, TestCase
+
+if DJANGO:
+    from django.core.exceptions import ValidationError
+
+    from tests.testapp.models import Post
+
+
+class ValidateUniqueTest(TestCase):
+
+    def setUp(self):
+        self.today = datetime.date.today()
+        Post(slug='hello', published=self.today, code='a').save()
+
+    def test_unique_for_date_still_checked(self):
+        with self.assertRaises(ValidationError) as context:
+            Post(slug='hello', published=self.today, code='b').save()
+
+        self.assertIn('slug', context.exception.message_dict)
+
+        Post(slug='hello', published=self.today - datetime.timedelta(days=1), code='c').save()
+
+    def test_database_constraint_becomes_validation_error(self):
+        with self.assertRaises(ValidationError):
+            Post(slug='other', published=self.today, code='a').save()
+
+        with self.assertRaises(ValidationError):
+            Post(slug='other', published=self.today, code='a').save(using='default')
+
+    def test_bulk_full_clean_checks_unique_for_date(self):
+        objs = [Post(slug='hello', published=self.today, code='x'),
+                Post(slug='new', published=self.today, code='y')]
+
+        with self.assertRaises(ValidationError) as context:
+            Post.bulk_full_clean(objs)
+
+        self.assertEqual(list(context.exception.message_dict), [0])
+        self.assertTrue(context.exception.message_dict[0][0].startswith('slug: '))
+
+    def test_bulk_full_clean_checks_unique_fields(self):
+        objs = [Post(slug='one', published=self.today, code='a'),
+                Post(slug='two', published=self.today, code='z'),
+                Post(slug='three', published=self.today, code='z')]
+
+        self.assertEqual(Post.get_unique_clashes(objs, ('code',)), [0, 2])
+
+        with self.assertRaises(ValidationError) as context:
+            Post.bulk_full_clean(objs)
+
+        self.assertEqual(sorted(context.exception.message_dict), [0, 2])
@@ -0,0 +1,49 @@
+from tests.utils import DJANGO, TestCase
+
+if DJANGO:
+    from django.core.exceptions import ImproperlyConfigured
+
+    from django_tricks.workflow.fields import Workflow
+    from tests.testapp.models import Shipment
+
+
+class WorkflowTest(TestCase):
+
+    def setUp(self):
+        self.field = Shipment._meta.get_field('state')
+
+    def test_compiled_graph(self):
+        self.assertTrue(self.field.can_transition('paid', 'shipped'))
+        self.assertFalse(self.field.can_transition('shipped', 'paid'))
+        self.assertEqual(self.field.get_previous_states('shipped'), ('paid',))
+        self.assertEqual(Shipment(state='paid').get_next_states(),
+                         [('shipped', 'Ship'), ('cancelled', 'Cancel')])
+
+        with self.assertRaises(ImproperlyConfigured):
+            Workflow(Workflow.State('paid', 'Paid'), Workflow.Transition('paid', 'lost', 'lose'))
+
+    def test_bulk_transition(self):
+        paid = [Shipment.objects.create(state='paid').pk for _ in range(3)]
+        shipped = Shipment.objects.create(state='shipped').pk
+        received = []
+
+        def receiver(sender, pks, to_state, **kwargs):
+            received.append((sender, sorted(pks), to_state))
+
+        Workflow.bulk_transition.connect(receiver)
+
+        try:
+            updated, skipped = Shipment.objects.all().transition('state', 'shipped')
+        finally:
+            Workflow.bulk_transition.disconnect(receiver)
+
+        self.assertEqual((updated, skipped), (3, [shipped]))
+        self.assertEqual(received, [(Shipment, sorted(paid), 'shipped')])
+        self.assertEqual(Shipment.objects.filter(state='shipped').count(), 4)
+
+    def test_bulk_transition_batches(self):
+        Shipment.objects.bulk_create([Shipment(state='paid') for _ in range(1500)], batch_size=500)
+
+        updated, skipped = Shipment.objects.transition('state', 'cancelled')
+
+        self.assertEqual((updated, skipped), (1500, []))
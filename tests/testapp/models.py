@@ -0,0 +1,119 @@
+from django.conf import settings
+from django.db import models
+from django.db.models import F
+from django.utils import timezone
+
+from django_tricks.models.abstract import NumberCounterModel, treebeard
+from django_tricks.models.behaviors import ComputeFields, compute_expression, depends_on
+from django_tricks.models.fields import (BitFlagsField, LowerCharField, UnitField, UnitQuerySet,
+                                         UppercaseCharField)
+from django_tricks.models.mixins import AutoNumberModel, ValidateModel
+from django_tricks.models.numbering import CounterAllocator
+from django_tricks.workflow.fields import Workflow, WorkflowQuerySet
+
+
+class Order(models.Model):
+    price = models.IntegerField(default=0)
+    quantity = models.IntegerField(default=0)
+    total = models.IntegerField(default=0, editable=False)
+    label = models.CharField(max_length=50, blank=True, editable=False)
+
+    computed = ComputeFields()
+
+    @depends_on('price', 'quantity')
+    @compute_expression(F('price') * F('quantity'))
+    def compute_total(self):
+        return self.price * self.quantity
+
+    def compute_label(self):
+        return '%s x %s' % (self.quantity, self.price)
+
+
+class NumberCounter(NumberCounterModel):
+    pass
+
+
+class Invoice(AutoNumberModel, models.Model):
+    number = models.CharField(max_length=20, blank=True)
+
+    NUMBER_ALLOCATOR = CounterAllocator(NumberCounter, gapless=True)
+
+
+class Product(models.Model):
+    code = UppercaseCharField(max_length=20, blank=True)
+    email = LowerCharField(max_length=100, blank=True)
+
+
+class Post(ValidateModel, models.Model):
+    slug = models.SlugField(unique_for_date='published')
+    published = models.DateField()
+    code = models.CharField(max_length=20, unique=True)
+
+    VALIDATE_UNIQUE = False
+
+
+class Shipment(models.Model):
+    state = Workflow(
+        Workflow.State('paid', 'Paid'),
+        Workflow.State('shipped', 'Shipped'),
+        Workflow.State('cancelled', 'Cancelled'),
+        Workflow.Starts('paid'),
+        Workflow.Ends('shipped'),
+        Workflow.Transition('paid', 'shipped', 'ship'),
+        Workflow.Transition('paid', 'cancelled', 'cancel'),
+    )
+
+    objects = WorkflowQuerySet.as_manager()
+
+
+class Author(models.Model):
+    name = models.CharField(max_length=100)
+    modified = models.DateTimeField(auto_now=True)
+
+
+class Book(models.Model):
+    author = models.ForeignKey(Author, related_name='books', on_delete=models.CASCADE)
+    title = models.CharField(max_length=100)
+    published = models.DateTimeField(default=timezone.now)
+
+
+class Trip(models.Model):
+    distance = UnitField(unit='m', null=True)
+
+    objects = UnitQuerySet.as_manager()
+
+
+BENCH_FLAGS = [('flag%s' % position, 'Flag %s' % position) for position in range(16)]
+
+
+class BitFlagged(models.Model):
+    flags = BitFlagsField(flags=BENCH_FLAGS)
+
+
+if 'postgresql' in settings.DATABASES['default']['ENGINE']:
+    from django_tricks.models.flags import FlagsField
+
+    class ArrayFlagged(models.Model):
+        flags = FlagsField(flags=BENCH_FLAGS, gin_index=True)
+
+
+if treebeard:
+    from django_tricks.models.abstract import CachedPathNode
+    from django_tricks.models.behaviors import Rollup
+
+    class Category(CachedPathNode):
+        name = models.CharField(max_length=100)
+        item_count = models.PositiveIntegerField(default=0, editable=False)
+        stock = models.IntegerField(default=0, editable=False)
+
+        items_rollup = Rollup('testapp.Item', 'category', 'item_count')
+        stock_rollup = Rollup('testapp.Item', 'category', 'stock', aggregate='sum', value_field='quantity')
+
+        node_order_by = []
+
+        def verbose_name(self):
+            return self.name
+
+    class Item(models.Model):
+        category = models.ForeignKey(Category, null=True, related_name='items', on_delete=models.CASCADE)
+        quantity = models.IntegerField(default=0)
@@ -0,0 +1,73 @@
+import atexit
+import importlib
+import os
+import shutil
+import unittest
+
+_ready = None
+
+
+def setup_django():
+    """Configure Django with `tests.settings` and create a throwaway test database.
+
+    Return False when Django can't be used here, so the tests needing it are skipped.
+    """
+    global _ready
+
+    if _ready is None:
+        try:
+            import django
+
+            os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tests.settings')
+            django.setup()
+        except ImportError:
+            _ready = False
+        else:
+            from django.conf import settings
+            from django.db import connection, connections
+            from django.test.utils import setup_test_environment
+
+            setup_test_environment()
+            old_name = connection.settings_dict['NAME']
+            connection.creation.create_test_db(verbosity=0)
+
+            atexit.register(shutil.rmtree, settings.TEST_DIR, True)
+            atexit.register(connection.creation.destroy_test_db, old_name, verbosity=0)
+            # Run first, the test database can't be dropped while connected to it
+            atexit.register(lambda: [conn.close() for conn in connections.all()])
+            _ready = True
+
+    return _ready
+
+
+def has_module(name):
+    try:
+        importlib.import_module(name)
+    except ImportError:
+        return False
+    return True
+
+
+DJANGO = setup_django()
+
+
+def is_postgresql():
+    if not DJANGO:
+        return False
+
+    from django.db import connection
+    return connection.vendor == 'postgresql'
+
+
+requires_postgresql = unittest.skipUnless(is_postgresql(), 'Needs PostgreSQL')
+requires_treebeard = unittest.skipUnless(DJANGO and has_module('treebeard'), 'Needs django-treebeard')
+
+
+if DJANGO:
+    from django.test import TestCase, TransactionTestCase
+else:
+    @unittest.skip('Django is not available')
+    class TestCase(unittest.TestCase):
+        pass
+
+    TransactionTestCase = TestCase